@@ -7,6 +7,15 @@ DIR="/usr/local/bin";
 # The name of the program after installation:
 PROGRAM="katoolin3";
 
+# The name of the daemon, a link to the program:
+DAEMON="katoolin3d";
+
+# Where the systemd unit of the daemon is installed:
+UNITDIR="/etc/systemd/system";
+
+# Where the package list is installed:
+DATADIR="/usr/local/share/katoolin3";
+
 # Show error message and quit:
 die(){
     if [ "$*" ];
@@ -23,6 +23,14 @@ wget -q -O - https://archive.kali.org/archive-key.asc | apt-key add
 apt-get -qq -y -m install python3-apt || die;
 
 install -T -g root -o root -m 555 ./katoolin3.py "$DIR/$PROGRAM" || die;
+install -D -T -g root -o root -m 444 ./packages.json "$DATADIR/packages.json" || die;
+ln -sf "$PROGRAM" "$DIR/$DAEMON" || die;
+
+# The daemon is optional, start it with 'systemctl enable --now katoolin3d':
+if [ -d "$UNITDIR" ];
+then
+    sed "s|/usr/local/bin/katoolin3d|$DIR/$DAEMON|" ./katoolin3d.service > "$UNITDIR/$DAEMON.service" || die;
+fi
 
 echo "Successfully installed."
 echo "Run it with 'sudo $PROGRAM_PREFIX$PROGRAM'.";
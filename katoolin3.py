@@ -26,484 +26,214 @@ __author__ = "s-h-3-l-l"
 __credits__ = ["LionSec"]
 __license__ = "GPL"
 
+import argparse
+import asyncio
+import builtins
+import contextlib
+from array import array
+from bisect import bisect_left
+import email.utils
+import fcntl
+import gzip
+import hashlib
+import heapq
+import http.client
+import http.server
+import json
+import marshal
+import mmap
 import os
-from collections import namedtuple
-from math import ceil
+from collections import namedtuple, OrderedDict
+from math import ceil, log
 import platform
-import shlex
+import re
+import shutil
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import termios
 import textwrap
+import threading
+import time
+import tty
+import urllib.error
+import urllib.parse
+import urllib.request
 
 try:
     import apt
+    import apt_pkg
 except ImportError:
     print("Please install the 'python3-apt' package")
     exit(1)
 
-# The list of kali programs available in the repo with the format:
+# The files the list of kali programs is read from.
+# The list has the format:
 # {
 #   category_name : [list of packages in category]
 # }
 # The category names have to be identical to those on
 # https://tools.kali.org/tools-listing !
-PACKAGES = {
-    "Information Gathering" : [
-        "0trace",
-        "arping",
-        "braa",
-        "dmitry",
-        "dnsenum",
-        "dnsmap",
-        "dnsrecon",
-        "dnstracer",
-        "dnswalk",
-        "enum4linux",
-        "fierce",
-        "firewalk",
-        "fping",
-        "fragrouter",
-        "ftester",
-        "hping3",
-        "ike-scan",
-        "intrace",
-        "irpas",
-        "lbd",
-        "legion",
-        "maltego",
-        "masscan",
-        "metagoofil",
-        "nbtscan",
-        "ncat",
-        "netdiscover",
-        "netmask",
-        "nmap",
-        "onesixtyone",
-        "p0f",
-        "qsslcaudit",
-        "recon-ng",
-        "smbmap",
-        "smtp-user-enum",
-        "snmpcheck",
-        "ssldump",
-        "sslh",
-        "sslscan",
-        "sslyze",
-        "swaks",
-        "thc-ipv6",
-        "theharvester",
-        "tlssled",
-        "twofi",
-        "unicornscan",
-        "urlcrazy",
-        "wafw00f",
-        "xprobe"
-    ],
-    "Vulnerability Analysis" : [
-        "afl++",
-        "bed",
-        "cisco-auditing-tool",
-        "cisco-global-exploiter",
-        "cisco-ocs",
-        "cisco-torch",
-        "copy-router-config",
-        "dhcpig",
-        "enumiax",
-        "gvm",
-        "iaxflood",
-        "inviteflood",
-        "legion",
-        "lynis",
-        "nikto",
-        "nmap",
-        "ohrwurm",
-        "protos-sip",
-        "rtpbreak",
-        "rtpflood",
-        "rtpinsertsound",
-        "rtpmixsound",
-        "sctpscan",
-        "sfuzz",
-        "siege",
-        "siparmyknife",
-        "sipp",
-        "sipsak",
-        "sipvicious",
-        "slowhttptest",
-        "spike",
-        "t50",
-        "thc-ssl-dos",
-        "unix-privesc-check",
-        "voiphopper",
-        "yersinia"
-    ],
-    "Web Application Analysis" : [
-        "apache-users",
-        "apache2",
-        "beef-xss",
-        "burpsuite",
-        "cadaver",
-        "commix",
-        "cutycapt",
-        "davtest",
-        "default-mysql-server",
-        "dirb",
-        "dirbuster",
-        "dotdotpwn",
-        "eyewitness",
-        "ftester",
-        "hamster-sidejack",
-        "heartleech",
-        "httprint",
-        "httrack",
-        "hydra",
-        "hydra-gtk",
-        "jboss-autopwn",
-        "joomscan",
-        "jsql-injection",
-        "laudanum",
-        "lbd",
-        "maltego",
-        "medusa",
-        "mitmproxy",
-        "ncrack",
-        "nikto",
-        "nishang",
-        "nmap",
-        "oscanner",
-        "owasp-mantra-ff",
-        "padbuster",
-        "paros",
-        "patator",
-        "php",
-        "php-mysql",
-        "plecost",
-        "proxychains4",
-        "proxytunnel",
-        "qsslcaudit",
-        "redsocks",
-        "sidguesser",
-        "siege",
-        "skipfish",
-        "slowhttptest",
-        "sqldict",
-        "sqlitebrowser",
-        "sqlmap",
-        "sqlninja",
-        "sqlsus",
-        "ssldump",
-        "sslh",
-        "sslscan",
-        "sslsniff",
-        "sslsplit",
-        "sslyze",
-        "stunnel4",
-        "thc-ssl-dos",
-        "tlssled",
-        "tnscmd10g",
-        "uniscan",
-        "wafw00f",
-        "wapiti",
-        "watobo",
-        "webacoo",
-        "webscarab",
-        "webshells",
-        "weevely",
-        "wfuzz",
-        "whatweb",
-        "wireshark",
-        "wpscan",
-        "xsser",
-        "zaproxy"
-    ],
-    "Database Assessment": [
-        "jsql-injection",
-        "mdbtools",
-        "oscanner",
-        "sidguesser",
-        "sqldict",
-        "sqlitebrowser",
-        "sqlmap",
-        "sqlninja",
-        "sqlsus",
-        "tnscmd10g"
-    ],
-    "Password Attacks" : [
-        "cewl",
-        "chntpw",
-        "cisco-auditing-tool",
-        "cmospwd",
-        "crackle",
-        "creddump7",
-        "crunch",
-        "fcrackzip",
-        "freerdp2-x11",
-        "gpp-decrypt",
-        "hash-identifier",
-        "hashcat",
-        "hashcat-utils",
-        "hashid",
-        "hydra",
-        "hydra-gtk",
-        "john",
-        "johnny",
-        "kali-tools-gpu",
-        "maskprocessor",
-        "medusa",
-        "mimikatz",
-        "ncrack",
-        "onesixtyone",
-        "ophcrack",
-        "ophcrack-cli",
-        "pack",
-        "passing-the-hash",
-        "patator",
-        "pdfcrack",
-        "pipal",
-        "polenum",
-        "rainbowcrack",
-        "rarcrack",
-        "rcracki-mt",
-        "rsmangler",
-        "samdump2",
-        "seclists",
-        "sipcrack",
-        "sipvicious",
-        "smbmap",
-        "sqldict",
-        "statsprocessor",
-        "sucrack",
-        "thc-pptp-bruter",
-        "truecrack",
-        "twofi",
-        "wordlists"
-    ],
-    "Wireless Attacks" : [
-        "kali-tools-802-11",
-        "kali-tools-bluetooth",
-        "kali-tools-rfid",
-        "kali-tools-sdr",
-        "rfcat",
-        "rfkill",
-        "sakis3g",
-        "spectools",
-        "wireshark"
-    ],
-    "Reverse Engineering" : [
-        "apktool",
-        "bytecode-viewer",
-        "clang",
-        "dex2jar",
-        "edb-debugger",
-        "jadx",
-        "javasnoop",
-        "jd-gui",
-        "metasploit-framework",
-        "ollydbg",
-        "radare2",
-        "radare2-cutter"
-    ],
-    "Exploitation Tools" : [
-        "armitage",
-        "backdoor-factory",
-        "beef-xss",
-        "cymothoa",
-        "dbd",
-        "dns2tcp",
-        "exe2hexbat",
-        "exploitdb",
-        "iodine",
-        "laudanum",
-        "metasploit-framework",
-        "mimikatz",
-        "miredo",
-        "msfpc",
-        "nishang",
-        "powersploit",
-        "proxychains4",
-        "proxytunnel",
-        "ptunnel",
-        "pwnat",
-        "sbd",
-        "set",
-        "shellnoob",
-        "shellter",
-        "sqlmap",
-        "sslh",
-        "stunnel4",
-        "termineter",
-        "udptunnel",
-        "veil",
-        "webacoo",
-        "weevely"
-    ],
-    "Sniffing & Spoofing" : [
-        "bettercap",
-        "darkstat",
-        "dnschef",
-        "driftnet",
-        "dsniff",
-        "ettercap-graphical",
-        "ettercap-text-only",
-        "fiked",
-        "hamster-sidejack",
-        "hexinject",
-        "isr-evilgrade",
-        "macchanger",
-        "mitmproxy",
-        "netsniff-ng",
-        "rebind",
-        "responder",
-        "sniffjoke",
-        "sslsniff",
-        "sslsplit",
-        "tcpflow",
-        "tcpreplay",
-        "wifi-honey",
-        "wireshark",
-        "yersinia"
-    ],
-    "Post Exploitation": [
-        "backdoor-factory",
-        "cymothoa",
-        "dbd",
-        "dns2tcp",
-        "exe2hexbat",
-        "iodine",
-        "laudanum",
-        "mimikatz",
-        "miredo",
-        "nishang",
-        "powersploit",
-        "proxychains4",
-        "proxytunnel",
-        "ptunnel",
-        "pwnat",
-        "sbd",
-        "shellter",
-        "sslh",
-        "stunnel4",
-        "udptunnel",
-        "veil",
-        "webacoo",
-        "weevely"
-    ],
-    "Forensics" : [
-        "afflib-tools",
-        "apktool",
-        "autopsy",
-        "binwalk",
-        "bulk-extractor",
-        "bytecode-viewer",
-        "cabextract",
-        "chkrootkit",
-        "creddump7",
-        "dc3dd",
-        "dcfldd",
-        "ddrescue",
-        "dumpzilla",
-        "edb-debugger",
-        "ewf-tools",
-        "exifprobe",
-        "exiv2",
-        "ext3grep",
-        "ext4magic",
-        "extundelete",
-        "fcrackzip",
-        "firmware-mod-kit",
-        "foremost",
-        "forensic-artifacts",
-        "forensics-colorize",
-        "galleta",
-        "gdb",
-        "gpart",
-        "gparted",
-        "grokevt",
-        "guymager",
-        "hashdeep",
-        "inetsim",
-        "jadx",
-        "javasnoop",
-        "libhivex-bin",
-        "lvm2",
-        "lynis",
-        "mac-robber",
-        "mdbtools",
-        "memdump",
-        "metacam",
-        "missidentify",
-        "myrescue",
-        "nasm",
-        "nasty",
-        "ollydbg",
-        "p7zip-full",
-        "parted",
-        "pasco",
-        "pdf-parser",
-        "pdfid",
-        "pev",
-        "plaso",
-        "polenum",
-        "pst-utils",
-        "python3-capstone",
-        "python3-dfdatetime",
-        "python3-dfvfs",
-        "python3-dfwinreg",
-        "python3-distorm3",
-        "radare2",
-        "radare2-cutter",
-        "recoverdm",
-        "recoverjpeg",
-        "reglookup",
-        "regripper",
-        "rephrase",
-        "rifiuti",
-        "rifiuti2",
-        "rkhunter",
-        "rsakeyfind",
-        "safecopy",
-        "samdump2",
-        "scalpel",
-        "scrounge-ntfs",
-        "sleuthkit",
-        "smali",
-        "sqlitebrowser",
-        "ssdeep",
-        "tcpdump",
-        "tcpflow",
-        "tcpick",
-        "tcpreplay",
-        "truecrack",
-        "undbx",
-        "unhide",
-        "unar",
-        "unrar",
-        "upx-ucl",
-        "vinetto",
-        "wce",
-        "winregfs",
-        "wireshark",
-        "xmount",
-        "xplico",
-        "yara"
-    ],
-    "Reporting Tools" : [
-        "cutycapt",
-        "dradis",
-        "eyewitness",
-        "faraday",
-        "maltego",
-        "metagoofil",
-        "pipal",
-        "recordmydesktop"
-    ],
-    "Social Engineering Tools": [
-        "backdoor-factory",
-        "beef-xss",
-        "maltego",
-        "msfpc",
-        "set",
-        "veil"
-    ]
-}
+PACKAGES_FILES = [
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), "packages.json"),
+    "/usr/local/share/katoolin3/packages.json"
+]
+
+# Site-local changes to the list with the format:
+# {
+#   "add" : {category_name : [list of packages]},
+#   "hide" : [list of packages]
+# }
+PACKAGES_OVERLAY = "/etc/katoolin3/overlay.json"
+
+# The merged list is cached here in a format that loads a lot faster:
+PACKAGES_CACHE = "/var/cache/katoolin3/packages.cache"
+
+def packages_file():
+    """
+    Return the path of the package list that is used.
+    """
+    for path in PACKAGES_FILES:
+        if os.path.isfile(path):
+            return path
+
+    return None
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+        return (path, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return (path, None, None)
+
+def merge_overlay(packages, overlay):
+    """
+    Apply a site-local overlay to the package list.
+    """
+    hidden = set(overlay.get("hide", []))
+
+    for cat, pkgs in overlay.get("add", {}).items():
+        lst = packages.setdefault(cat, [])
+        lst.extend(pkg for pkg in pkgs if pkg not in lst)
+
+    return {
+        cat: [pkg for pkg in pkgs if pkg not in hidden]
+        for cat, pkgs in packages.items()
+        if any(pkg not in hidden for pkg in pkgs)
+    }
+
+def load_packages():
+    """
+    Load the package list with the overlay applied.
+
+    The result is cached in marshal format and reused
+    as long as neither of the source files changes.
+    """
+    path = packages_file()
+
+    if path is None:
+        print("Could not find the package list (packages.json)")
+        exit(1)
+
+    key = [_file_stamp(path), _file_stamp(PACKAGES_OVERLAY)]
+
+    try:
+        with open(PACKAGES_CACHE, "rb") as file:
+            cached = marshal.load(file)
+
+        if cached["key"] == key:
+            return cached["packages"]
+    except (OSError, EOFError, ValueError, TypeError, KeyError):
+        pass
+
+    try:
+        with open(path, "r") as file:
+            packages = json.load(file)
+    except (OSError, ValueError) as e:
+        print("Could not read the package list: {}".format(e))
+        exit(1)
+
+    try:
+        with open(PACKAGES_OVERLAY, "r") as file:
+            packages = merge_overlay(packages, json.load(file))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print("Ignoring {}: {}".format(PACKAGES_OVERLAY, e))
+
+    try:
+        os.makedirs(os.path.dirname(PACKAGES_CACHE), exist_ok=True)
+        tmp = PACKAGES_CACHE + ".tmp"
+
+        with open(tmp, "wb") as file:
+            marshal.dump({"key": key, "packages": packages}, file)
+
+        os.rename(tmp, PACKAGES_CACHE)
+    except OSError:
+        pass
+
+    return packages
+
+PACKAGES = load_packages()
+
+class PackageRecord:
+    """
+    Everything katoolin3 knows about a tool from PACKAGES.
+    """
+    __slots__ = ("name", "nice_name", "categories")
+
+    def __init__(self, name, nice_name, categories=()):
+        self.name = name
+        self.nice_name = nice_name
+        self.categories = categories
+
+class PackageRegistry:
+    """
+    Lookup tables that are built once from PACKAGES
+    so that nobody has to scan the lists again.
+    """
+    def __init__(self, packages):
+        # name -> PackageRecord
+        self._records = {}
+        # category -> sorted names
+        self._categories = {}
+
+        for cat, pkgs in packages.items():
+            self._categories[cat] = tuple(sorted(set(pkgs)))
+
+            for pkg in pkgs:
+                if pkg not in self._records:
+                    self._records[pkg] = PackageRecord(pkg, nice_name(pkg))
+
+                if cat not in self._records[pkg].categories:
+                    self._records[pkg].categories += (cat,)
+
+        self.names = frozenset(self._records)
+        self.sorted_names = tuple(sorted(self._records))
+
+    def __contains__(self, pkg):
+        return pkg in self._records
+
+    def __getitem__(self, pkg):
+        return self._records[pkg]
+
+    def categories(self, pkg):
+        """
+        Return the categories a package is in, if any.
+        """
+        try:
+            return self._records[pkg].categories
+        except KeyError:
+            return ()
+
+    def category(self, cat):
+        """
+        Return the sorted package names of a category.
+        """
+        return self._categories[cat]
 
 class Terminal:
     """
@@ -520,10 +250,381 @@ class Terminal:
     white = "\033[1;37m"
     reset = "\033[0m"
     underscore = "\033[4m"
+    clear = "\033[2J\033[H"
+
+class TraceSpan:
+    """
+    A context manager that records how long its body takes.
+    """
+    def __init__(self, tracer, name, cat, args):
+        self._tracer = tracer
+        self._name = name
+        self._cat = cat
+        self._args = args
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *nil):
+        end = time.perf_counter()
+        self.duration = end - self._start
+        self._tracer.complete(self._name, self._cat, self._start, end, self._args)
+
+class Tracer:
+    """
+    Records where the time of a session goes and writes it
+    in the Chrome trace format that chrome://tracing and
+    https://ui.perfetto.dev can display.
+
+    This does nothing unless it is enabled.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._events = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def _micros(self, t):
+        return (t - self._origin) * 1e6
+
+    def _add(self, event):
+        event["pid"] = os.getpid()
+        event["tid"] = threading.get_ident()
+
+        with self._lock:
+            self._events.append(event)
+
+    def span(self, name, cat="katoolin3", **args):
+        """
+        Return a context manager that records its duration.
+        """
+        return TraceSpan(self, name, cat, args)
+
+    def complete(self, name, cat, start, end, args=None):
+        if self.enabled:
+            self._add({
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": self._micros(start),
+                "dur": self._micros(end) - self._micros(start),
+                "args": args or {}
+            })
+
+    def begin(self, name, cat="katoolin3"):
+        """
+        Start a span that cannot be wrapped in a with statement.
+        It has to be ended in the same thread.
+        """
+        if self.enabled:
+            self._add({"name": name, "cat": cat, "ph": "B", "ts": self._micros(time.perf_counter())})
+
+    def end(self, name, cat="katoolin3"):
+        if self.enabled:
+            self._add({"name": name, "cat": cat, "ph": "E", "ts": self._micros(time.perf_counter())})
+
+    def save(self, path):
+        with self._lock:
+            data = {"traceEvents": list(self._events), "displayTimeUnit": "ms"}
+
+        with open(path, "w") as file:
+            json.dump(data, file)
+
+# Used everywhere to record the duration of the interesting phases:
+TRACER = Tracer()
+
+class Metrics:
+    """
+    Collects numbers about a run and writes them in the
+    text format of the node_exporter textfile collector.
+
+    All metrics are gauges that describe the last run.
+    """
+    _help = {
+        "katoolin3_update_duration_seconds": "Time spent in apt-get update",
+        "katoolin3_cache_load_duration_seconds": "Time spent opening the package cache",
+        "katoolin3_cache_packages": "Number of packages in the package cache",
+        "katoolin3_tools": "Number of tools katoolin3 knows about",
+        "katoolin3_mark_duration_seconds": "Time spent marking packages for installation",
+        "katoolin3_download_duration_seconds": "Time spent downloading archives",
+        "katoolin3_dpkg_duration_seconds": "Time spent in dpkg",
+        "katoolin3_fetched_bytes": "Number of bytes downloaded",
+        "katoolin3_failed_packages": "Number of packages that could not be installed",
+        "katoolin3_skipped_packages": "Number of packages that were not found",
+        "katoolin3_lock_wait_seconds": "Time spent waiting for other package managers",
+        "katoolin3_last_run_success": "Whether the last run finished without an error",
+        "katoolin3_last_run_timestamp_seconds": "When the last run finished"
+    }
+
+    def __init__(self):
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted(labels.items()))
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, self._labels(labels))] = value
+
+    def add(self, name, value, **labels):
+        key = (name, self._labels(labels))
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items(), key=lambda item: item[0])
+
+        lines = []
+        last = None
+
+        for (name, labels), value in values:
+            if name != last:
+                lines.append("# HELP {} {}".format(name, self._help[name]))
+                lines.append("# TYPE {} gauge".format(name))
+                last = name
+
+            if labels:
+                name += "{" + ",".join('{}="{}"'.format(k, self._escape(v)) for k, v in labels) + "}"
+
+            lines.append("{} {}".format(name, repr(float(value))))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Write the metrics to 'path' atomically so that
+        node_exporter never sees a half written file.
+        """
+        self.set("katoolin3_last_run_timestamp_seconds", time.time())
+        tmp = "{}.{}".format(path, os.getpid())
+
+        with open(tmp, "w") as file:
+            file.write(self.render())
+
+        os.replace(tmp, path)
+
+# Collects the numbers for --metrics:
+METRICS = Metrics()
+
+class Job:
+    """
+    An operation that runs in the background, see JobQueue.
+    Everything it prints is kept as a list of (time, message)
+    events instead of going to the terminal.
+    """
+    def __init__(self, number, title, dpkg):
+        self.number = number
+        self.title = title
+        # Whether the job has to wait for the other dpkg jobs:
+        self.dpkg = dpkg
+        # One of "queued", "running", "done" and "failed":
+        self.state = "queued"
+        self.percent = None
+        self.events = []
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self._line = ""
+
+    def emit(self, msg, percent=None):
+        """
+        Record a progress event.
+        """
+        if percent is not None:
+            self.percent = percent
+
+        msg = msg.strip()
+
+        # dpkg reports the same status for every step of a package
+        if msg and (not self.events or self.events[-1][1] != msg):
+            self.events.append((time.time(), msg))
+
+    def write(self, text):
+        """
+        Take output that was meant for the terminal. Like on a
+        terminal a carriage return overwrites the current line,
+        so only the last state of a progress line is kept.
+        """
+        *lines, self._line = (self._line + text).split("\n")
+
+        for line in lines:
+            self.emit(line.rpartition("\r")[2])
+
+        self._line = self._line.rpartition("\r")[2]
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def summary(self):
+        state = self.state
+
+        if state == "running" and self.percent is not None:
+            state = "{:.0f}%".format(self.percent)
+
+        return "#{} {} ({})".format(self.number, self.title, state)
+
+class JobQueue:
+    """
+    Runs installations and removals as jobs on an asyncio event
+    loop in a thread of its own so that the menu stays usable.
+
+    Jobs that use dpkg run one after the other, in the order
+    they were submitted. The operations themselves block, so
+    the loop hands each of them to a thread of its executor.
+    While a dpkg job runs it has the cache of APT to itself.
+    """
+    def __init__(self):
+        self._loop = None
+        self._dpkg_lock = None
+        self._jobs = []
+        # The job each thread of the executor is working on:
+        self._current = {}
+        self._reported = set()
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+
+            self._loop = asyncio.new_event_loop()
+
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        # Older versions of asyncio bind locks to the loop they are created in
+        self._dpkg_lock = asyncio.run_coroutine_threadsafe(self._create_lock(), self._loop).result()
+
+    async def _create_lock(self):
+        return asyncio.Lock()
+
+    def submit(self, title, func, *args, dpkg=True):
+        """
+        Run 'func(*args)' in the background and return its Job.
+        """
+        self._start()
+
+        with self._lock:
+            job = Job(len(self._jobs) + 1, title, dpkg)
+            self._jobs.append(job)
+
+        asyncio.run_coroutine_threadsafe(self._run(job, func, args), self._loop)
+        return job
+
+    async def _run(self, job, func, args):
+        if job.dpkg:
+            async with self._dpkg_lock:
+                await self._loop.run_in_executor(None, self._call, job, func, args)
+        else:
+            await self._loop.run_in_executor(None, self._call, job, func, args)
+
+    def _call(self, job, func, args):
+        self._current[threading.get_ident()] = job
+        job.state = "running"
+
+        try:
+            with APT.exclusive() if job.dpkg else contextlib.nullcontext():
+                job.result = func(*args)
+        except StepBack as s:
+            if s.has_message():
+                job.emit(str(s))
+
+            job.state = "done"
+        except VisibleError as v:
+            job.error = str(v.__cause__)
+            job.state = "failed"
+        except Exception as e:
+            job.error = "{}: {}".format(type(e).__name__, e)
+            job.state = "failed"
+        else:
+            job.state = "done"
+        finally:
+            del self._current[threading.get_ident()]
+            job.done.set()
+
+    def current(self):
+        """
+        Return the job the calling thread works on or None.
+        """
+        return self._current.get(threading.get_ident())
+
+    def output(self):
+        """
+        Return where the calling thread should print to: the
+        job it works on or the terminal.
+        """
+        job = self.current()
+        return sys.stdout if job is None else job
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs)
+
+    def running(self):
+        return [job for job in self.jobs() if not job.done.is_set()]
+
+    def notices(self):
+        """
+        Return a message for every job that finished
+        since the last time this was called.
+        """
+        ret = []
+
+        for job in self.jobs():
+            if job.done.is_set() and job.number not in self._reported:
+                self._reported.add(job.number)
+
+                if job.state == "failed":
+                    ret.append("{}Job #{} failed: {} ({}){}".format(Terminal.red, job.number, job.title, job.error, Terminal.reset))
+                else:
+                    ret.append("{}Job #{} finished: {}{}".format(Terminal.green, job.number, job.title, Terminal.reset))
+
+        return ret
+
+    def wait(self):
+        """
+        Block until all jobs are finished.
+        """
+        running = self.running()
+
+        if running:
+            print("Waiting for {} job{} to finish...".format(len(running), "s" if len(running) > 1 else ""))
+
+        for job in running:
+            job.done.wait()
+
+# Runs the installations and removals of the menu and the daemon:
+JOBS = JobQueue()
+
+def report(*args):
+    """
+    Like print() but the output of a job goes to the job.
+    """
+    print(*args, file=JOBS.output())
 
 # Just some types used in Selection:
 Choice = namedtuple("Choice", ["text", "value", "color"])
 
+# What the menus need to know about a package:
+PackageState = namedtuple("PackageState", ["available", "installed", "upgradable"])
+
+# What the dpkg status file says about a package:
+DpkgStatus = namedtuple("DpkgStatus", ["installed", "version"])
+
+# A .deb that APT is going to download:
+Archive = namedtuple("Archive", ["uri", "filename", "size", "sha256"])
+
+# A result of SearchIndex.query():
+SearchHit = namedtuple("SearchHit", ["name", "summary", "score"])
+
 class InstallList(list):
     """
     If a list is wrapped in this class it means that
@@ -538,6 +639,57 @@ class UninstallList(list):
     be uninstalled.
     """
 
+class FilterIndex:
+    """
+    Finds all texts that contain a given string.
+
+    Every text is indexed by all of its substrings of up to 'n'
+    characters. Longer search strings only have to be compared
+    with the texts that contain all of their n-grams.
+    """
+    n = 3
+
+    def __init__(self, items):
+        """
+        items = iterable of (key, text)
+        """
+        self._texts = {}
+        self._grams = {}
+
+        for key, text in items:
+            text = text.lower()
+            self._texts[key] = text
+
+            for size in range(1, self.n + 1):
+                for i in range(len(text) - size + 1):
+                    self._grams.setdefault(text[i:i + size], set()).add(key)
+
+    def query(self, string):
+        """
+        Return the keys of all texts that contain 'string'.
+        """
+        string = string.lower()
+
+        if not string:
+            return set(self._texts)
+
+        if len(string) <= self.n:
+            return set(self._grams.get(string, ()))
+
+        grams = sorted(
+            set(string[i:i + self.n] for i in range(len(string) - self.n + 1)),
+            key=lambda gram: len(self._grams.get(gram, ()))
+        )
+        ret = set(self._grams.get(grams[0], ()))
+
+        for gram in grams[1:]:
+            if not ret:
+                break
+
+            ret &= self._grams.get(gram, set())
+
+        return set(key for key in ret if string in self._texts[key])
+
 class Selection:
     """
     This class encapsulates the procedure that presents
@@ -563,7 +715,9 @@ class Selection:
         self._colpad = 2
         self._delchar = "~"
         self._infochar = "?"
+        self._filterchar = "/"
         self._repeat = "!!"
+        self._filter_index = None
         self._prompt = "kat> "
 
     def _option_string(self, index):
@@ -583,8 +737,15 @@ class Selection:
         """
         Subsequently return the options formatted in columns
         """
+        return self._render(sorted(self._options))
+
+    def _render(self, keys):
+        """
+        Subsequently return the options with the indexes
+        in 'keys' formatted in columns
+        """
         # The number of options in the left column:
-        num_left = len(self._options)
+        num_left = len(keys)
 
         if num_left >= self._col_thresh:
             num_left = ceil(num_left / 2)
@@ -592,12 +753,10 @@ class Selection:
         # The maximum length an option on the left has:
         max_left = max(
             map(
-                lambda item: len(self._option_string(item[0])),
-                filter(
-                    lambda item: item[0] < num_left,
-                    self._options.items()
-                )
-            )
+                lambda key: len(self._option_string(key)),
+                keys[:num_left]
+            ),
+            default=0
         )
 
         # First the headline
@@ -608,16 +767,16 @@ class Selection:
         # Then the columns:
         for i in range(num_left):
             # Left column:
-            left = self._option_string(i)
+            left = self._option_string(keys[i])
             filler = " " * (max_left - len(left) + self._colpad)
-            left = self._options[i].color + left + Terminal.reset
+            left = self._options[keys[i]].color + left + Terminal.reset
 
             # Right column:
             right_index = num_left + i
 
-            if right_index in self._options:
-                right = self._option_string(right_index)
-                right = self._options[right_index].color + right + Terminal.reset
+            if right_index < len(keys):
+                right = self._option_string(keys[right_index])
+                right = self._options[keys[right_index]].color + right + Terminal.reset
             else:
                 right = ""
 
@@ -628,6 +787,86 @@ class Selection:
     def __len__(self):
         return len(self._options)
 
+    def _print(self, keys=None):
+        """
+        Print all options or only those in 'keys'.
+        """
+        with TRACER.span("render menu", "menu", headline=self._headline):
+            lines = list(self._render(sorted(self._options) if keys is None else keys))
+
+        # Let the user know about jobs that finished in the meantime
+        for notice in JOBS.notices():
+            print(notice)
+
+        for line in lines:
+            print(line)
+
+    def _filtered(self, string):
+        """
+        Return the indexes of all options whose text or
+        package name contains 'string'.
+        """
+        if self._filter_index is None:
+            # ALL, HELP and BACK are numbers, only their text counts
+            self._filter_index = FilterIndex(
+                (key, "{}\n{}".format(option.text, option.value) if isinstance(option.value, str) else option.text)
+                for key, option in self._options.items()
+            )
+
+        return sorted(self._filter_index.query(string))
+
+    def _filter(self):
+        """
+        Narrow down the displayed options with every keystroke
+        until the user hits ENTER. The options keep their
+        numbers so they can be selected as usual afterwards.
+        """
+        if not sys.stdin.isatty():
+            self._print(self._filtered(input("Filter: ")))
+            return
+
+        fd = sys.stdin.fileno()
+        old = termios.tcgetattr(fd)
+        string = ""
+        drawn = None
+        done = False
+
+        try:
+            tty.setcbreak(fd)
+
+            while True:
+                if string != drawn:
+                    print(Terminal.clear, end="")
+                    self._print(self._filtered(string))
+                    print("Filter: " + string, end="", flush=True)
+                    drawn = string
+
+                if done:
+                    break
+
+                # A key that sends several characters arrives in one piece
+                keys = os.read(fd, 32).decode("utf-8", errors="ignore")
+
+                if keys == "\x1b":
+                    # ESC shows everything again
+                    string = ""
+                    done = True
+                elif keys.startswith("\x1b"):
+                    # Arrow keys and the like
+                    continue
+
+                for char in keys:
+                    if char in ("\n", "\r"):
+                        done = True
+                        break
+                    elif char in ("\x7f", "\b"):
+                        string = string[:-1]
+                    elif char.isprintable():
+                        string += char
+        finally:
+            termios.tcsetattr(fd, termios.TCSADRAIN, old)
+            print()
+
     def _parse_selection(self, sel):
         """
         Expects a string like '1,3-5,7'
@@ -657,16 +896,14 @@ class Selection:
         The selection procedure where all options are listed
         and the user selects 1.
         """
-        for option in self:
-            print(option)
+        self._print()
 
         while True:
             try:
                 n = input(self._prompt)
 
                 if n == self._repeat:
-                    for option in self:
-                        print(option)
+                    self._print()
                     continue
 
                 n = int(n)
@@ -682,16 +919,22 @@ class Selection:
         value is a special list that indicates whether the selected
         packages shall be installed or uninstalled.
         """
-        for option in self:
-            print(option)
+        self._print()
 
         while True:
             try:
                 n = input(self._prompt)
 
                 if n == self._repeat:
-                    for option in self:
-                        print(option)
+                    self._print()
+                    continue
+
+                if n.startswith(self._filterchar):
+                    if n == self._filterchar:
+                        self._filter()
+                    else:
+                        self._print(self._filtered(n[1:]))
+
                     continue
 
                 ret = InstallList()
@@ -753,53 +996,2007 @@ class APTException(Exception):
     An exception that indicates an error with APTManager.
     """
 
-class APTManager:
+class ReplayMismatch(Exception):
     """
-    A wrapper class for operations with aptitude
+    Raised by SessionReplayer when APTManager asks the cache
+    for something that was not asked for in the recording.
     """
-    sources_file = "/etc/apt/sources.list.d/katoolin3.list"
-
-    def __init__(self, silent=False):
-        self._cache = None
-        self._success_code = 0
-        self._silent = silent
 
-    def __enter__(self):
+class IndexFreshness:
+    """
+    Remembers when the Kali package indexes were last fetched
+    and what their InRelease file looked like.
+
+    The Kali lists vanish from the APT lists directory once
+    katoolin3 exits and the sources file is gone, so a copy
+    of them is kept in the state directory. On the next launch
+    the copy is put back instead of running 'apt-get update' if
+    it is younger than the TTL or if the InRelease file on the
+    mirror hasn't changed since.
+    """
+    state_dir = "/var/lib/katoolin3"
+    default_ttl = 6 * 60 * 60
+
+    def __init__(self, mirror, suite, ttl=None):
+        self._mirror = mirror.rstrip("/")
+        self._suite = suite
+        self._ttl = self.default_ttl if ttl is None else ttl
+        self._stash_dir = os.path.join(self.state_dir, "lists")
+        self._state_file = os.path.join(self.state_dir, "freshness.json")
+        self._lists_dir = apt_pkg.config.find_dir("Dir::State::lists")
+        self._prefix = apt_pkg.uri_to_filename(self._mirror + "/")
+
+    def _release_url(self):
+        return "{}/dists/{}/InRelease".format(self._mirror, self._suite)
+
+    def _list_files(self, directory):
         """
-        Installs the sources file and updates the APT cache.
+        Return the names of all Kali list files in 'directory'.
         """
-        arch = detect_arch()
-
-        if arch:
-            arch = "[arch={}]".format(arch)
+        try:
+            return [
+                name for name in os.listdir(directory)
+                if name.startswith(self._prefix)
+            ]
+        except OSError:
+            return []
+
+    def _hash_file(self, path):
+        try:
+            with open(path, "rb") as file:
+                return hashlib.sha256(file.read()).hexdigest()
+        except OSError:
+            return None
 
+    def _remote_release_hash(self):
+        """
+        Fetch the InRelease file from the mirror and hash it.
+        This is a few KB compared to the megabytes of a full update.
+        """
         try:
-            with open(self.sources_file, "w") as file:
-                file.write("# This file was automatically created by katoolin3. DO NOT MODIFY\n")
-                file.write("deb {} http://http.kali.org/kali kali-rolling main contrib non-free\n".format(arch))
-        except OSError as e:
-            raise VisibleError() from e
+            with urllib.request.urlopen(self._release_url(), timeout=10) as r:
+                return hashlib.sha256(r.read()).hexdigest()
+        except (OSError, ValueError):
+            return None
 
-        self.update()
-        return self
+    def _load_state(self):
+        try:
+            with open(self._state_file, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
 
-    def __exit__(self, *nil):
+    def _save_state(self, state):
         try:
-            os.remove(self.sources_file)
-        except OSError as e:
-            raise VisibleError() from e
-        finally:
-            self._cache.close()
-            # Launch update in background
-            os.system("apt-get -m -y -qq update &")
+            os.makedirs(self.state_dir, exist_ok=True)
 
-    def __getitem__(self, item):
+            with open(self._state_file, "w") as file:
+                json.dump(state, file)
+        except OSError:
+            pass
+
+    def record(self):
+        """
+        Remember that the indexes have just been fetched.
+        """
+        release = apt_pkg.uri_to_filename(self._release_url())
+
+        self._save_state({
+            "fetched": time.time(),
+            "release": self._hash_file(os.path.join(self._lists_dir, release))
+        })
+
+    def stash(self):
+        """
+        Copy the current Kali lists into the state directory.
+        """
+        names = self._list_files(self._lists_dir)
+
+        if not names:
+            return
+
+        try:
+            shutil.rmtree(self._stash_dir, ignore_errors=True)
+            os.makedirs(self._stash_dir)
+
+            for name in names:
+                shutil.copy2(
+                    os.path.join(self._lists_dir, name),
+                    os.path.join(self._stash_dir, name)
+                )
+        except OSError:
+            shutil.rmtree(self._stash_dir, ignore_errors=True)
+
+    def restore(self):
+        """
+        Put the stashed lists back into the APT lists directory
+        if they are still usable.
+        Returns False if a real update is required.
+        """
+        state = self._load_state()
+        names = self._list_files(self._stash_dir)
+
+        if state is None or not state.get("release") or not names:
+            return False
+
+        if time.time() - state["fetched"] > self._ttl:
+            if self._remote_release_hash() != state["release"]:
+                return False
+
+            state["fetched"] = time.time()
+            self._save_state(state)
+
+        try:
+            for name in names:
+                shutil.copy2(
+                    os.path.join(self._stash_dir, name),
+                    os.path.join(self._lists_dir, name)
+                )
+        except OSError:
+            return False
+
+        return True
+
+    def list_stamps(self):
+        """
+        Return the names and modification times of the Kali lists.
+        The stashed copies are used if the lists haven't been
+        restored yet. They keep their original timestamps.
+        """
+        for directory in (self._lists_dir, self._stash_dir):
+            ret = []
+
+            for name in self._list_files(directory):
+                try:
+                    ret.append([name, os.stat(os.path.join(directory, name)).st_mtime_ns])
+                except OSError:
+                    pass
+
+            if ret:
+                return sorted(ret)
+
+        return []
+
+    def drop(self):
+        """
+        Remove the Kali lists from the APT lists directory
+        without touching the lists of any other source.
+        """
+        for name in self._list_files(self._lists_dir):
+            try:
+                os.remove(os.path.join(self._lists_dir, name))
+            except OSError:
+                pass
+
+class PackageSnapshot:
+    """
+    A small file in the state directory that holds the candidate
+    version of every package in PACKAGES so that the menus can be
+    built without loading the APT cache. Whether a package is
+    installed is read from the dpkg status file each time.
+
+    The snapshot is only valid as long as neither the Kali lists
+    nor the packages katoolin3 knows about change.
+    """
+    path = os.path.join(IndexFreshness.state_dir, "snapshot.json")
+
+    def __init__(self, freshness):
+        self._freshness = freshness
+
+    def _key(self):
+        names = "\n".join(sorted(REGISTRY.names)).encode("utf-8")
+
+        return {
+            "lists": self._freshness.list_stamps(),
+            "packages": hashlib.sha256(names).hexdigest()
+        }
+
+    def load(self):
+        """
+        Return {name: candidate version or None} or None
+        if the snapshot is missing or outdated.
+        """
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if data.get("key") != self._key():
+            return None
+
+        return data["packages"]
+
+    def save(self, candidates):
+        data = {
+            "key": self._key(),
+            "packages": candidates
+        }
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+            with open(self.path, "w") as file:
+                json.dump(data, file, separators=(",", ":"))
+        except OSError:
+            pass
+
+class FetchProgress(apt.progress.base.AcquireProgress):
+    """
+    Shows the download progress, traces the download phase
+    and records its duration for 'category'.
+
+    The progress goes to 'output', which is the job of the
+    calling thread by default. Unlike apt.progress.text this
+    doesn't install a signal handler, which only works in the
+    main thread.
+    """
+    def __init__(self, category, output=None):
+        super().__init__()
+        self._category = category
+        self._output = JOBS.output() if output is None else output
+        self._job = self._output if isinstance(self._output, Job) else None
+        self._span = False
+
+    def start(self):
+        super().start()
+        self._started = time.perf_counter()
+        self._span = True
+        TRACER.begin("fetch", "commit")
+
+    def end_span(self):
+        """
+        End the span of the download unless it is over already,
+        e.g. because the transaction failed in the middle of it.
+        """
+        if self._span:
+            self._span = False
+            TRACER.end("fetch", "commit")
+
+    def fetch(self, item):
+        self._output.write("\rGet:{} {}\n".format(item.owner.id, item.description))
+
+    def fail(self, item):
+        if item.owner.status == item.owner.STAT_DONE:
+            self._output.write("\rIgn:{} {}\n".format(item.owner.id, item.description))
+        else:
+            self._output.write("\rErr:{} {}\n  {}\n".format(item.owner.id, item.description, item.owner.error_text))
+
+    def pulse(self, owner):
+        super().pulse(owner)
+
+        if self.total_bytes:
+            percent = self.current_bytes * 100 / self.total_bytes
+
+            if self._job is not None:
+                self._job.emit("", percent)
+            else:
+                self._output.write("\r[{:3.0f}%] {}B/s ".format(percent, apt_pkg.size_to_str(self.current_cps)))
+                self._output.flush()
+
+        return True
+
+    def stop(self):
+        super().stop()
+        self.end_span()
+        duration = time.perf_counter() - self._started
+
+        if self.fetched_bytes:
+            self._output.write("\rFetched {}B in {:.0f}s\n".format(apt_pkg.size_to_str(self.fetched_bytes), duration))
+
+        METRICS.add("katoolin3_download_duration_seconds", duration, category=self._category)
+        METRICS.add("katoolin3_fetched_bytes", self.fetched_bytes)
+
+class DpkgProgress(apt.progress.base.InstallProgress):
+    """
+    Traces the dpkg phase of a transaction and signals 'event'
+    as soon as dpkg starts working, i.e. when all archives
+    of the transaction have been downloaded.
+
+    In a background job dpkg must neither ask questions nor
+    write to the terminal, so it is detached from it and its
+    progress is reported to the job instead. The output of
+    dpkg still ends up in /var/log/apt/term.log.
+    """
+    def __init__(self, category, event=None):
+        super().__init__()
+        self._category = category
+        self._event = event
+        self._job = JOBS.current()
+        self._span = False
+
+    def fork(self):
+        pid = super().fork()
+
+        if pid == 0 and self._job is not None:
+            # Keep CTRL+C in the menu away from dpkg
+            os.setsid()
+            os.environ["DEBIAN_FRONTEND"] = "noninteractive"
+            # Keep modified configuration files without asking
+            apt_pkg.config.set("DPkg::Options::", "--force-confdef")
+            apt_pkg.config.set("DPkg::Options::", "--force-confold")
+            null = os.open(os.devnull, os.O_RDWR)
+
+            for fd in range(3):
+                os.dup2(null, fd)
+
+        return pid
+
+    def status_change(self, pkg, percent, status):
+        if self._job is not None:
+            self._job.emit(status, percent)
+
+    def error(self, pkg, errormsg):
+        if self._job is not None:
+            self._job.emit("Error with package {}: {}".format(pkg, errormsg))
+
+    def start_update(self):
+        self._started = time.perf_counter()
+        self._span = True
+        TRACER.begin("dpkg", "commit")
+
+        if self._event is not None:
+            self._event.set()
+
+    def end_span(self):
+        """
+        End the span of dpkg unless it is over already,
+        e.g. because dpkg failed.
+        """
+        if self._span:
+            self._span = False
+            TRACER.end("dpkg", "commit")
+
+    def finish_update(self):
+        self.end_span()
+        METRICS.add("katoolin3_dpkg_duration_seconds", time.perf_counter() - self._started, category=self._category)
+
+class AptLocks:
+    """
+    Finds the processes that hold the locks of dpkg and APT,
+    e.g. unattended-upgrades or another apt-get, and waits
+    for them instead of letting libapt fail right away.
+    """
+    # struct flock on Linux:
+    _flock = "hhqqi"
+
+    def __init__(self, timeout, max_delay=10):
+        self.timeout = timeout
+        self._max_delay = max_delay
+
+    @staticmethod
+    def dpkg_paths():
+        """
+        Return the locks a transaction needs.
+        """
+        admin_dir = os.path.dirname(apt_pkg.config.find_file("Dir::State::status"))
+
+        return [
+            os.path.join(admin_dir, "lock-frontend"),
+            os.path.join(admin_dir, "lock"),
+            os.path.join(apt_pkg.config.find_dir("Dir::Cache::archives"), "lock")
+        ]
+
+    @staticmethod
+    def lists_paths():
+        """
+        Return the locks 'apt-get update' needs.
+        """
+        return [os.path.join(apt_pkg.config.find_dir("Dir::State::lists"), "lock")]
+
+    @classmethod
+    def holder(cls, path):
+        """
+        Return the PID of the process that holds the lock
+        'path' or None if it is free. Locks held by this
+        process don't count.
+        """
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+
+        try:
+            query = struct.pack(cls._flock, fcntl.F_WRLCK, os.SEEK_SET, 0, 0, 0)
+            lock_type, _, _, _, pid = struct.unpack(cls._flock, fcntl.fcntl(fd, fcntl.F_GETLK, query))
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+
+        return None if lock_type == fcntl.F_UNLCK else pid
+
+    @staticmethod
+    def process_name(pid):
+        try:
+            with open("/proc/{}/comm".format(pid)) as file:
+                return file.read().strip()
+        except OSError:
+            return "an unknown process"
+
+    def holders(self, paths):
+        """
+        Return {path: description of the holder} for the
+        locks in 'paths' that are held by other processes.
+        """
+        ret = {}
+
+        for path in paths:
+            pid = self.holder(path)
+
+            if pid is not None:
+                # Open file description locks have no owner
+                ret[path] = "{} ({})".format(self.process_name(pid), pid) if pid > 0 else self.process_name(pid)
+
+        return ret
+
+    def wait(self, paths, quiet=False):
+        """
+        Block until the locks in 'paths' are free. The delay between
+        two checks doubles up to 'max_delay' seconds. Raises
+        VisibleError if they are still held after 'timeout' seconds.
+        Unless 'quiet' is set it tells who is holding them.
+        """
+        holders = self.holders(paths)
+
+        if not holders:
+            return
+
+        start = time.monotonic()
+        delay = 0.5
+        last = None
+
+        with TRACER.span("wait for lock", "lock"):
+            while holders:
+                waited = time.monotonic() - start
+
+                if waited >= self.timeout:
+                    raise VisibleError() from APTException("{} is still locked by {}".format(*next(iter(holders.items()))))
+
+                # Only say something when the holders change
+                if holders != last and not quiet:
+                    for path, holder in holders.items():
+                        report("Waiting for {} to release {}...".format(holder, path))
+
+                    last = holders
+
+                time.sleep(min(delay, self.timeout - waited))
+                delay = min(delay * 2, self._max_delay)
+                holders = self.holders(paths)
+
+        METRICS.add("katoolin3_lock_wait_seconds", time.monotonic() - start)
+
+class DeferredUpdate:
+    """
+    Refreshes all package lists after katoolin3 exits.
+
+    Every request only leaves a marker in the state directory.
+    A single detached katoolin3 process runs 'apt-get update'
+    as long as there are markers, so requests that come in
+    while it is busy are merged into one more update and
+    back-to-back runs never start a second apt-get.
+    """
+    def __init__(self, locks):
+        self._locks = locks
+        self._marker = os.path.join(IndexFreshness.state_dir, "update.pending")
+        self._lock_file = os.path.join(IndexFreshness.state_dir, "update.lock")
+
+    def request(self):
+        try:
+            os.makedirs(IndexFreshness.state_dir, exist_ok=True)
+            open(self._marker, "w").close()
+
+            subprocess.Popen(
+                [
+                    sys.executable, os.path.realpath(__file__),
+                    "--deferred-update", "--lock-timeout", str(self._locks.timeout)
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True
+            )
+        except OSError as e:
+            raise VisibleError() from e
+
+    def satisfied(self):
+        """
+        Forget pending requests because the lists were just refreshed.
+        """
+        try:
+            os.remove(self._marker)
+        except OSError:
+            pass
+
+    def run(self):
+        """
+        Update until there are no more requests. Returns
+        right away if another process is doing that already.
+        """
+        # Checking again after unlocking catches requests whose
+        # process gave up on the lock just before it was released
+        while os.path.exists(self._marker):
+            with open(self._lock_file, "w") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # The other process will see the marker
+                    return
+
+                while os.path.exists(self._marker):
+                    self._locks.wait(self._locks.lists_paths())
+                    self.satisfied()
+                    subprocess.run(["apt-get", "-m", "-y", "-qq", "update"])
+
+class DeferredTriggers:
+    """
+    Keeps dpkg from running triggers (man-db, icon caches, ldconfig, ...)
+    after every transaction and runs all pending triggers once
+    on exit, even if one of the transactions failed.
+    """
+    options = {
+        "DPkg::NoTriggers": "true",
+        "DPkg::ConfigurePending": "false",
+        "DPkg::TriggersPending": "false"
+    }
+
+    def __init__(self, locks):
+        self._locks = locks
+        self._saved = {}
+
+    def __enter__(self):
+        for key, value in self.options.items():
+            self._saved[key] = apt_pkg.config.find(key)
+            apt_pkg.config.set(key, value)
+
+        return self
+
+    def __exit__(self, exc_type, *nil):
+        for key, value in self._saved.items():
+            if value:
+                apt_pkg.config.set(key, value)
+            else:
+                apt_pkg.config.clear(key)
+
+        report("Processing triggers...")
+        command = ["dpkg", "--configure", "--pending"]
+        options = {}
+
+        if JOBS.current() is not None:
+            # Like DpkgProgress.fork(): don't scribble over or read from
+            # the menu, keep CTRL+C away and never ask about conffiles
+            command[1:1] = ["--force-confdef", "--force-confold"]
+            options = {
+                "stdin": subprocess.DEVNULL,
+                "stdout": subprocess.DEVNULL,
+                "stderr": subprocess.DEVNULL,
+                "start_new_session": True,
+                "env": dict(os.environ, DEBIAN_FRONTEND="noninteractive")
+            }
+
+        try:
+            # After e.g. a lock timeout don't wait all over again,
+            # dpkg fails right away if the lock is still held
+            if exc_type is None:
+                self._locks.wait(AptLocks.dpkg_paths())
+
+            ok = subprocess.run(command, **options).returncode == 0
+        except VisibleError as v:
+            report(v)
+            ok = False
+
+        if not ok:
+            report(Terminal.red + "Processing the triggers failed. Run 'sudo dpkg --configure -a' to fix this." + Terminal.reset)
+
+class ArchivePrefetcher:
+    """
+    Downloads the archives of the next batch into the APT archive
+    directory while dpkg is busy installing the current batch.
+    APT finds them there and skips the download.
+
+    At most 'budget' bytes are prefetched, everything else
+    is left for APT to download itself. So is everything that
+    wasn't started yet when the current batch is done.
+    """
+    def __init__(self, budget):
+        self._budget = budget
+        self._archives_dir = apt_pkg.config.find_dir("Dir::Cache::archives")
+        self._thread = None
+        self._stop = threading.Event()
+        self.dpkg_started = threading.Event()
+
+    @staticmethod
+    def archive_name(name, version, arch):
+        """
+        Return the file name APT uses for a downloaded archive.
+        """
+        def quote(string, bad):
+            return "".join(
+                "%{:02x}".format(ord(c)) if c in bad or c == "%" else c
+                for c in string
+            )
+
+        return "{}_{}_{}.deb".format(
+            quote(name, "_:"),
+            quote(version, "_:"),
+            quote(arch, "_:.")
+        )
+
+    def start(self, archives):
+        self._thread = threading.Thread(target=self._run, args=(archives,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Let the current file finish so that the next batch can
+        use it, skip the others and wait for the thread.
+        """
+        self._stop.set()
+        self.dpkg_started.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+    def _fetch(self, archive):
+        dest = os.path.join(self._archives_dir, archive.filename)
+        partial = os.path.join(self._archives_dir, "partial", archive.filename)
+        digest = hashlib.sha256()
+
+        try:
+            with urllib.request.urlopen(archive.uri, timeout=30) as r, open(partial, "wb") as file:
+                for chunk in iter(lambda: r.read(1 << 16), b""):
+                    digest.update(chunk)
+                    file.write(chunk)
+
+            if digest.hexdigest() != archive.sha256:
+                os.remove(partial)
+                return False
+
+            os.rename(partial, dest)
+            return True
+        except (OSError, ValueError):
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+
+            return False
+
+    def _run(self, archives):
+        # Don't compete with APTs own downloads
+        self.dpkg_started.wait()
+        used = 0
+
+        for archive in archives:
+            if self._stop.is_set():
+                break
+
+            try:
+                if os.path.getsize(os.path.join(self._archives_dir, archive.filename)) == archive.size:
+                    continue
+            except OSError:
+                pass
+
+            if used + archive.size > self._budget:
+                continue
+
+            if self._fetch(archive):
+                used += archive.size
+
+class SearchIndex:
+    """
+    An inverted index over the names, summaries and descriptions
+    of all packages in the cache.
+
+    Building it takes a while so it is saved in the state directory
+    and only rebuilt when the package lists change. It is saved as
+    plain data in marshal format, so the file can be read no matter
+    under which module name katoolin3 was loaded when it was written.
+    """
+    path = os.path.join(IndexFreshness.state_dir, "search.idx")
+    # How much a match in the respective field counts:
+    name_weight = 8
+    summary_weight = 3
+    description_weight = 1
+    # Shorter search terms only match whole words:
+    min_prefix = 3
+
+    def __init__(self, key, names, summaries, postings):
+        self.key = key
+        self._names = names
+        self._summaries = summaries
+        # word -> (document ids as unsigned ints, weights), both as bytes
+        self._postings = postings
+        self._vocabulary = sorted(postings)
+
+    @staticmethod
+    def tokenize(text):
+        return re.findall(r"[a-z0-9]+", text.lower())
+
+    @classmethod
+    def build(cls, key, cache):
+        names = []
+        summaries = []
+        weights = {}
+
+        for pkg in cache:
+            ver = pkg.candidate
+
+            if ver is None:
+                continue
+
+            doc = len(names)
+            names.append(pkg.name)
+            summaries.append(ver.summary or "")
+            fields = [
+                (cls.tokenize(pkg.name) + [pkg.name], cls.name_weight),
+                (cls.tokenize(ver.summary or ""), cls.summary_weight),
+                (cls.tokenize(ver.description or ""), cls.description_weight)
+            ]
+
+            for tokens, weight in fields:
+                for token in set(tokens):
+                    docs = weights.setdefault(token, {})
+                    docs[doc] = min(255, docs.get(doc, 0) + weight)
+
+        postings = {
+            token: (array("I", docs.keys()).tobytes(), bytes(docs.values()))
+            for token, docs in weights.items()
+        }
+
+        return cls(key, names, summaries, postings)
+
+    @classmethod
+    def load(cls, key):
+        """
+        Return the saved index or None if it is missing or outdated.
+        """
+        try:
+            # marshal.load() reads files in tiny pieces
+            with open(cls.path, "rb") as file:
+                data = marshal.loads(file.read())
+
+            if data["key"] != key:
+                return None
+
+            return cls(key, data["names"], data["summaries"], data["postings"])
+        except (OSError, EOFError, ValueError, TypeError, KeyError):
+            return None
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        data = {
+            "key": self.key,
+            "names": self._names,
+            "summaries": self._summaries,
+            "postings": self._postings
+        }
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+            with open(tmp, "wb") as file:
+                marshal.dump(data, file)
+
+            os.rename(tmp, self.path)
+        except OSError:
+            pass
+
+    def _matches(self, token):
+        """
+        Return {document id: weight} for all words that start
+        with 'token'. Exact matches count double.
+        """
+        ret = {}
+
+        if len(token) < self.min_prefix:
+            words = [token] if token in self._postings else []
+        else:
+            words = []
+            i = bisect_left(self._vocabulary, token)
+
+            while i < len(self._vocabulary) and self._vocabulary[i].startswith(token):
+                words.append(self._vocabulary[i])
+                i += 1
+
+        for word in words:
+            factor = 2 if word == token else 1
+            docs, weights = self._postings[word]
+
+            for doc, weight in zip(memoryview(docs).cast("I"), weights):
+                if weight * factor > ret.get(doc, 0):
+                    ret[doc] = weight * factor
+
+        return ret
+
+    def query(self, text, limit=30):
+        """
+        Return the best 'limit' packages that match all words in 'text'.
+        """
+        scores = None
+
+        for token in set(self.tokenize(text)):
+            matches = self._matches(token)
+            # Rare words are worth more:
+            idf = log(1 + len(self._names) / (1 + len(matches)))
+
+            if scores is None:
+                scores = {doc: weight * idf for doc, weight in matches.items()}
+            else:
+                scores = {
+                    doc: scores[doc] + matches[doc] * idf
+                    for doc in scores.keys() & matches.keys()
+                }
+
+        if not scores:
+            return []
+
+        return [
+            SearchHit(self._names[doc], self._summaries[doc], score)
+            for doc, score in heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        ]
+
+class ProxyStore:
+    """
+    A content addressed file store with LRU eviction for the proxy.
+
+    Every object is stored under its SHA256 so files that are
+    served under several paths only take up space once.
+    An index maps request paths to objects in LRU order.
+    """
+    def __init__(self, directory, max_size):
+        self._dir = directory
+        self._max_size = max_size
+        self._index_file = os.path.join(directory, "index.json")
+        self._lock = threading.Lock()
+        # path -> [digest, size, time of download]
+        self._index = OrderedDict()
+
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+
+        try:
+            with open(self._index_file, "r") as file:
+                self._index.update(json.load(file))
+        except (OSError, ValueError):
+            pass
+
+    def _object_path(self, digest):
+        return os.path.join(self._dir, "objects", digest[:2], digest)
+
+    def _save(self):
+        tmp = self._index_file + ".tmp"
+
+        with open(tmp, "w") as file:
+            json.dump(self._index, file)
+
+        os.rename(tmp, self._index_file)
+
+    def get(self, path, max_age=None):
+        """
+        Return the file that holds the content of 'path' or None
+        if it isn't stored or older than 'max_age' seconds.
+        """
+        with self._lock:
+            entry = self._index.get(path)
+
+            if entry is None:
+                return None
+
+            if max_age is not None and time.time() - entry[2] > max_age:
+                return None
+
+            self._index.move_to_end(path)
+            return self._object_path(entry[0])
+
+    def tempfile(self):
+        """
+        Return a path where a download can be written to
+        before it is handed to put().
+        """
+        return os.path.join(self._dir, "tmp.{}.{}".format(os.getpid(), threading.get_ident()))
+
+    def put(self, path, tmp, digest, size):
+        """
+        Move the downloaded file 'tmp' into the store.
+        """
+        dest = self._object_path(digest)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+        with self._lock:
+            old = self._index.get(path)
+            os.replace(tmp, dest)
+            self._index[path] = [digest, size, time.time()]
+            self._index.move_to_end(path)
+
+            # Index files change under the same path
+            if old is not None and old[0] != digest and all(entry[0] != old[0] for entry in self._index.values()):
+                self._remove_object(old[0])
+
+            self._evict()
+            self._save()
+
+    def _remove_object(self, digest):
+        try:
+            os.remove(self._object_path(digest))
+        except OSError:
+            pass
+
+    def _evict(self):
+        # Other paths might have the same content so count the references:
+        refs = {}
+        sizes = {}
+
+        for digest, size, _ in self._index.values():
+            refs[digest] = refs.get(digest, 0) + 1
+            sizes[digest] = size
+
+        total = sum(sizes.values())
+
+        while len(self._index) > 1 and total > self._max_size:
+            _, (digest, size, _) = self._index.popitem(last=False)
+            refs[digest] -= 1
+
+            if refs[digest] == 0:
+                total -= size
+                self._remove_object(digest)
+
+class ProxyRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves files from the ProxyStore and fetches
+    everything else from the upstream mirror.
+    """
+    # Package indexes change, the pool doesn't
+    index_max_age = 5 * 60
+    upstream_timeout = 30
+
+    def log_message(self, *nil):
+        pass
+
+    def _discard(self, tmp):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+    def _send_headers(self, length):
+        self.send_response(200)
+
+        if length is not None:
+            self.send_header("Content-Length", length)
+
+        self.end_headers()
+
+    def _send_file(self, path):
+        with open(path, "rb") as file:
+            self.send_response(200)
+            self.send_header("Content-Length", str(os.fstat(file.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(file, self.wfile)
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+
+        # Anything else would make us fetch from other hosts or paths
+        if not path.startswith(self.server.prefix) or ".." in urllib.parse.unquote(path).split("/"):
+            self.send_error(403)
+            return
+
+        store = self.server.store
+        max_age = None if "/pool/" in path else self.index_max_age
+        cached = store.get(path, max_age)
+
+        if cached is not None:
+            self._send_file(cached)
+            return
+
+        tmp = store.tempfile()
+        digest = hashlib.sha256()
+        size = 0
+        # The status line goes out with the first chunk, until
+        # then the stored copy or an error can still be sent
+        sent = False
+
+        try:
+            with urllib.request.urlopen(self.server.upstream + path, timeout=self.upstream_timeout) as r, open(tmp, "wb") as file:
+                length = r.headers.get("Content-Length")
+                last = b""
+
+                while True:
+                    chunk = r.read(1 << 16)
+
+                    if not chunk:
+                        break
+
+                    if not sent:
+                        self._send_headers(length)
+                        sent = True
+
+                    digest.update(chunk)
+                    size += len(chunk)
+                    file.write(chunk)
+                    self.wfile.write(last)
+                    last = chunk
+
+                # HTTPResponse.read() doesn't complain about a short body
+                if length is not None and size != int(length):
+                    raise urllib.error.ContentTooShortError("Got {} of {} bytes".format(size, length), None)
+        except urllib.error.HTTPError as e:
+            self._discard(tmp)
+            self.send_error(e.code)
+            return
+        except (OSError, http.client.HTTPException):
+            self._discard(tmp)
+
+            if sent:
+                # A second status line would corrupt the response
+                self.close_connection = True
+                return
+
+            # Better outdated than nothing
+            cached = store.get(path)
+
+            if cached is not None:
+                self._send_file(cached)
+            else:
+                self.send_error(502)
+
+            return
+
+        if not sent:
+            self._send_headers(length)
+
+        # Hold back the last chunk until the file is stored so that
+        # asking again right after the response is served from the store
+        store.put(path, tmp, digest.hexdigest(), size)
+        self.wfile.write(last)
+
+class KaliProxy(http.server.ThreadingHTTPServer):
+    """
+    A small caching HTTP proxy for the Kali repository.
+
+    Point other katoolin3 instances at it with
+        --mirror http://<host>:<port>/kali
+    where /kali is the path of 'mirror'. Nothing outside
+    of that path is served.
+    """
+    daemon_threads = True
+    default_store = "/var/cache/katoolin3/proxy"
+
+    def __init__(self, address, store, mirror):
+        super().__init__(address, ProxyRequestHandler)
+        upstream = urllib.parse.urlsplit(mirror)
+        self.store = store
+        self.upstream = "{}://{}".format(upstream.scheme, upstream.netloc)
+        self.prefix = upstream.path.rstrip("/") + "/"
+
+class LeanDependency:
+    """
+    An or-group of dependencies like apt.package.Dependency.
+    """
+    BaseDependency = namedtuple("BaseDependency", ["name", "relation", "version"])
+
+    def __init__(self, group):
+        self.or_dependencies = [
+            self.BaseDependency(dep.target_pkg.name, dep.comp_type, dep.target_ver)
+            for dep in group
+        ]
+
+    @property
+    def rawstr(self):
+        return " | ".join(
+            "{} ({} {})".format(dep.name, dep.relation, dep.version) if dep.version else dep.name
+            for dep in self.or_dependencies
+        )
+
+class LeanVersion:
+    """
+    The parts of apt.package.Version that katoolin3 uses,
+    read straight from the package records.
+    """
+    Origin = namedtuple("Origin", ["origin"])
+
+    def __init__(self, package, ver):
+        self.package = package
+        self._ver = ver
+        self._cache = package._cache
+
+    def __str__(self):
+        return "{}={}".format(self.package.name, self.version)
+
+    def _record(self):
+        """
+        Point the package records at this version and return them.
+        """
+        records = self._cache._records
+        records.lookup(self._ver.file_list[0])
+        return records
+
+    def _description_record(self):
+        records = self._cache._records
+        desc = self._ver.translated_description
+
+        if desc is not None and desc.file_list:
+            records.lookup(desc.file_list[0])
+        else:
+            records.lookup(self._ver.file_list[0])
+
+        return records
+
+    @property
+    def version(self):
+        return self._ver.ver_str
+
+    @property
+    def architecture(self):
+        return self._ver.arch
+
+    @property
+    def size(self):
+        return self._ver.size
+
+    @property
+    def dependencies(self):
+        return [
+            LeanDependency(group)
+            for kind in ("PreDepends", "Depends")
+            for group in self._ver.depends_list.get(kind, [])
+        ]
+
+    @property
+    def origins(self):
+        return [self.Origin(pkg_file.origin) for pkg_file, _ in self._ver.file_list]
+
+    @property
+    def homepage(self):
+        return self._record().homepage
+
+    @property
+    def record(self):
+        return self._record().record
+
+    @property
+    def sha256(self):
+        hashes = self._record().hashes.find("sha256")
+        return hashes.hashvalue if hashes else None
+
+    @property
+    def uri(self):
+        filename = self._record().filename
+        index = self._cache._sources.find_index(self._ver.file_list[0][0])
+        return index.archive_uri(filename) if index else None
+
+    @property
+    def summary(self):
+        return self._description_record().short_desc
+
+    @property
+    def description(self):
+        lines = self._description_record().long_desc.split("\n")[1:]
+        return "\n".join(
+            "" if line.strip() == "." else line.strip()
+            for line in lines
+        )
+
+    def fetch_binary(self, destdir, progress=None):
+        """
+        Download the archive into 'destdir' and return its path.
+        """
+        records = self._record()
+        dest = os.path.join(destdir, os.path.basename(records.filename))
+        acquire = apt_pkg.Acquire(progress or apt.progress.base.AcquireProgress())
+        item = apt_pkg.AcquireFile(
+            acquire,
+            self.uri,
+            hash=self._record().hashes,
+            size=self.size,
+            destfile=dest
+        )
+        acquire.run()
+
+        if item.status != item.STAT_DONE:
+            raise apt.cache.FetchFailedException(
+                "Failed to fetch {}: {}".format(self.uri, item.error_text)
+            )
+
+        return dest
+
+class LeanPackage:
+    """
+    The parts of apt.Package that katoolin3 uses,
+    implemented on top of apt_pkg.
+    """
+    def __init__(self, cache, pkg):
+        self._cache = cache
+        self._pkg = pkg
+
+    @property
+    def name(self):
+        return self._pkg.get_fullname(True)
+
+    @property
+    def shortname(self):
+        return self._pkg.name
+
+    @property
+    def is_installed(self):
+        return self._pkg.current_ver is not None
+
+    @property
+    def is_upgradable(self):
+        return self.is_installed and self._cache._depcache.is_upgradable(self._pkg)
+
+    @property
+    def marked_install(self):
+        return self._cache._depcache.marked_install(self._pkg)
+
+    @property
+    def marked_delete(self):
+        return self._cache._depcache.marked_delete(self._pkg)
+
+    @property
+    def candidate(self):
+        ver = self._cache._depcache.get_candidate_ver(self._pkg)
+        return LeanVersion(self, ver) if ver is not None else None
+
+    @property
+    def versions(self):
+        return [LeanVersion(self, ver) for ver in self._pkg.version_list]
+
+    def _fix(self, remove=False):
+        """
+        Let the problem resolver repair the marks like apt.Package does.
+        """
+        depcache = self._cache._depcache
+
+        if depcache.broken_count > 0:
+            fix = apt_pkg.ProblemResolver(depcache)
+            fix.clear(self._pkg)
+            fix.protect(self._pkg)
+
+            if remove:
+                fix.remove(self._pkg)
+
+            fix.resolve(True)
+
+    def mark_install(self):
+        self._cache._depcache.mark_install(self._pkg, True, True)
+        self._fix()
+
+    def mark_delete(self):
+        self._cache._depcache.mark_delete(self._pkg, False)
+        self._fix(remove=True)
+
+class LeanCache:
+    """
+    A replacement for apt.Cache that is built directly on
+    apt_pkg.Cache and apt_pkg.DepCache.
+
+    apt.Cache collects the names of all packages and creates a
+    Python object for every package it hands out. This only
+    wraps the packages katoolin3 actually asks for, which makes
+    opening faster and needs a lot less memory.
+    """
+    def __init__(self):
+        self.open()
+
+    def open(self):
+        self._cache = apt_pkg.Cache(None)
+        self._depcache = apt_pkg.DepCache(self._cache)
+        self._records = apt_pkg.PackageRecords(self._cache)
+        self._sources = apt_pkg.SourceList()
+        self._sources.read_main_list()
+
+    def close(self):
+        self._cache = None
+        self._depcache = None
+        self._records = None
+
+    def _wrap(self, pkg):
+        return LeanPackage(self, pkg)
+
+    def __getitem__(self, name):
+        pkg = self._cache[name]
+
+        # Like apt.Cache there are no purely virtual packages
+        if not pkg.has_versions:
+            raise KeyError(name)
+
+        return self._wrap(pkg)
+
+    def __len__(self):
+        # Unlike apt.Cache this includes virtual packages
+        return self._cache.package_count
+
+    def __iter__(self):
+        for pkg in self._cache.packages:
+            if pkg.has_versions:
+                yield self._wrap(pkg)
+
+    def has_key(self, name):
+        try:
+            return self._cache[name].has_versions
+        except KeyError:
+            return False
+
+    def get_providing_packages(self, name):
+        try:
+            provides = self._cache[name].provides_list
+        except KeyError:
+            return []
+
+        return [self._wrap(ver.parent_pkg) for _, _, ver in provides]
+
+    @property
+    def broken_count(self):
+        return self._depcache.broken_count
+
+    @property
+    def dpkg_journal_dirty(self):
+        updates = os.path.join(
+            os.path.dirname(apt_pkg.config.find_file("Dir::State::status")),
+            "updates"
+        )
+
+        try:
+            return any(name.isdigit() for name in os.listdir(updates))
+        except OSError:
+            return False
+
+    def clear(self):
+        self._depcache.init()
+
+    def get_changes(self):
+        """
+        Return the packages with marks. apt_pkg can't list them, so this
+        walks the cache, but only until it found as many as there are.
+        """
+        depcache = self._depcache
+        todo = depcache.inst_count + depcache.del_count
+        ret = []
+
+        if todo == 0:
+            return ret
+
+        for pkg in self._cache.packages:
+            if not depcache.marked_keep(pkg):
+                ret.append(self._wrap(pkg))
+
+                if len(ret) == todo:
+                    break
+
+        return ret
+
+    def _fetch(self, fetcher):
+        """
+        Download the archives in 'fetcher' and raise the
+        exceptions apt.Cache raises if that goes wrong.
+        """
+        untrusted = [item.desc_uri for item in fetcher.items if not item.is_trusted]
+
+        if untrusted and not apt_pkg.config.find_b("APT::Get::AllowUnauthenticated", False):
+            raise apt.cache.UntrustedException("Untrusted packages:\n" + "\n".join(untrusted))
+
+        res = fetcher.run()
+        failed = [
+            "Failed to fetch {} {}".format(item.desc_uri, item.error_text)
+            for item in fetcher.items
+            if item.status not in (item.STAT_DONE, item.STAT_IDLE)
+        ]
+
+        if res == fetcher.RESULT_CANCELLED:
+            raise apt.cache.FetchCancelledException("\n".join(failed))
+
+        if failed:
+            raise apt.cache.FetchFailedException("\n".join(failed))
+
+    def commit(self, fetch_progress=None, install_progress=None):
+        """
+        Download and install the marked changes like apt.Cache.commit()
+        does, with the same locks and the same check for archives
+        that can't be authenticated.
+        """
+        fetch_progress = fetch_progress or apt.progress.base.AcquireProgress()
+        install_progress = install_progress or apt.progress.base.InstallProgress()
+        archives = apt_pkg.config.find_dir("Dir::Cache::Archives")
+
+        with apt_pkg.SystemLock():
+            pm = apt_pkg.PackageManager(self._depcache)
+
+            try:
+                archive_lock = apt_pkg.FileLock(os.path.join(archives, "lock"))
+                archive_lock.__enter__()
+            except apt_pkg.Error as e:
+                raise apt.cache.LockFailedException("Failed to lock directory {}: {}".format(archives, e))
+
+            try:
+                while True:
+                    fetcher = apt_pkg.Acquire(fetch_progress)
+                    pm.get_archives(fetcher, self._sources, self._records)
+                    self._fetch(fetcher)
+                    install_progress.start_update()
+
+                    # dpkg takes the lock itself
+                    if apt_pkg.pkgsystem_is_locked():
+                        apt_pkg.pkgsystem_unlock_inner()
+
+                        try:
+                            res = install_progress.run(pm)
+                        finally:
+                            apt_pkg.pkgsystem_lock_inner()
+                    else:
+                        res = install_progress.run(pm)
+
+                    install_progress.finish_update()
+
+                    if res == pm.RESULT_COMPLETED:
+                        return True
+
+                    if res == pm.RESULT_FAILED:
+                        raise SystemError("installArchives() failed")
+
+                    # RESULT_INCOMPLETE means the next medium is needed
+                    fetcher.shutdown()
+            finally:
+                archive_lock.__exit__(None, None, None)
+
+def encode_session_args(args, kwargs):
+    """
+    Return 'args' and 'kwargs' in a form that can be written to a
+    session log. Objects that can't be written are replaced by
+    their type, progress objects for example.
+    """
+    def encode(value):
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+
+        if isinstance(value, (list, tuple)):
+            return [encode(item) for item in value]
+
+        if isinstance(value, (RecordedObject, ReplayedObject)):
+            return {"ref": value._ref}
+
+        return {"type": type(value).__name__}
+
+    return [encode(arg) for arg in args], {key: encode(value) for key, value in kwargs.items()}
+
+class RecordedObject:
+    """
+    Stands in for an object of the package cache and
+    logs every access to it together with its result.
+    """
+    __slots__ = ("_session", "_obj", "_ref")
+
+    def __init__(self, session, obj, ref):
+        self._session = session
+        self._obj = obj
+        self._ref = ref
+
+    def __getattr__(self, name):
+        if callable(getattr(type(self._obj), name, None)):
+            def method(*args, **kwargs):
+                return self._session.record(
+                    self._ref, "call", name, (args, kwargs),
+                    lambda: getattr(self._obj, name)(*args, **kwargs)
+                )
+
+            return method
+
+        return self._session.record(self._ref, "get", name, None, lambda: getattr(self._obj, name))
+
+    def __getitem__(self, key):
+        return self._session.record(self._ref, "item", key, None, lambda: self._obj[key])
+
+    def __contains__(self, key):
+        return self._session.record(self._ref, "contains", key, None, lambda: key in self._obj)
+
+    def __iter__(self):
+        return iter(self._session.record(self._ref, "iter", None, None, lambda: list(self._obj)))
+
+    def __len__(self):
+        return self._session.record(self._ref, "len", None, None, lambda: len(self._obj))
+
+    def __bool__(self):
+        return self._session.record(self._ref, "bool", None, None, lambda: bool(self._obj))
+
+    def __str__(self):
+        return self._session.record(self._ref, "str", None, None, lambda: str(self._obj))
+
+class SessionRecorder:
+    """
+    A backend for APTManager that wraps another backend and writes
+    every call APTManager makes to the cache, its result and how long
+    it took to a session log. SessionReplayer feeds them back later.
+
+    A copy of the dpkg status file is kept next to the log at the
+    start and after every commit so that the replay sees the same
+    installed packages.
+    """
+    version = 1
+    # The snapshot and the search index on disk aren't part of the
+    # log, so a replay would take another path if they were used:
+    stateless = True
+
+    def __init__(self, path, backend=apt.Cache):
+        self._path = path
+        self._backend = backend
+        self._lock = threading.Lock()
+        self._refs = 0
+        self._statuses = 0
+        self._file = open(path, "w")
+        self.write({"op": "start", "version": self.version, "status": self._save_status()})
+
+    def __call__(self):
+        start = time.perf_counter()
+        cache = self._backend()
+        ms = (time.perf_counter() - start) * 1000
+        ret = self._wrap(cache)
+        self.write({"op": "open", "ref": ret._ref, "ms": ms})
+        return ret
+
+    def close(self):
+        self._file.close()
+
+    def write(self, entry):
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+
+    def _save_status(self):
+        """
+        Copy the dpkg status file next to the log and return its name.
+        """
+        name = "{}.status{}".format(os.path.basename(self._path), self._statuses)
+        self._statuses += 1
+        shutil.copyfile(
+            apt_pkg.config.find_file("Dir::State::status"),
+            os.path.join(os.path.dirname(os.path.abspath(self._path)), name)
+        )
+        return name
+
+    def _wrap(self, obj):
+        with self._lock:
+            self._refs += 1
+            return RecordedObject(self, obj, self._refs)
+
+    def _encode(self, value):
+        """
+        Return (what to log, what to hand to APTManager) for 'value'.
+        """
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value, value
+
+        # Not subclasses, apt.package.Dependency is a list with attributes
+        if type(value) in (list, tuple, set, frozenset):
+            pairs = [self._encode(item) for item in value]
+            return {"list": [pair[0] for pair in pairs]}, [pair[1] for pair in pairs]
+
+        ret = self._wrap(value)
+        return {"ref": ret._ref}, ret
+
+    def record(self, ref, op, name, call_args, func):
+        entry = {"op": op, "ref": ref, "name": name}
+
+        if call_args is not None:
+            entry["args"], entry["kwargs"] = encode_session_args(*call_args)
+
+        start = time.perf_counter()
+
+        try:
+            value = func()
+        except Exception as e:
+            entry["ms"] = (time.perf_counter() - start) * 1000
+            entry["error"] = type(e).__name__
+            entry["message"] = str(e)
+            raise
+        else:
+            entry["ms"] = (time.perf_counter() - start) * 1000
+            entry["result"], value = self._encode(value)
+            return value
+        finally:
+            if op == "call" and name == "commit":
+                entry["status"] = self._save_status()
+
+            self.write(entry)
+
+class RecordedManager:
+    """
+    Stands in for the global APTManager and logs every
+    public method the menus call on it with its duration.
+    """
+    def __init__(self, manager, session):
+        self._manager = manager
+        self._session = session
+
+    def __getattr__(self, name):
+        attr = getattr(self._manager, name)
+
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        def method(*args, **kwargs):
+            # Generators can only be consumed once
+            args = [list(arg) if hasattr(arg, "__next__") else arg for arg in args]
+            entry = {"op": "api", "name": name}
+            entry["args"], entry["kwargs"] = encode_session_args(args, kwargs)
+            start = time.perf_counter()
+
+            try:
+                return attr(*args, **kwargs)
+            except BaseException as e:
+                entry["error"] = type(e).__name__
+                raise
+            finally:
+                entry["ms"] = (time.perf_counter() - start) * 1000
+                self._session.write(entry)
+
+        return method
+
+class ReplayedObject:
+    """
+    Stands in for an object of a recorded package cache.
+    """
+    __slots__ = ("_session", "_ref")
+
+    def __init__(self, session, ref):
+        self._session = session
+        self._ref = ref
+
+    def __getattr__(self, name):
+        if self._session.is_method(self._ref, name):
+            def method(*args, **kwargs):
+                return self._session.replay(self._ref, "call", name, (args, kwargs))
+
+            return method
+
+        return self._session.replay(self._ref, "get", name)
+
+    def __getitem__(self, key):
+        return self._session.replay(self._ref, "item", key)
+
+    def __contains__(self, key):
+        return self._session.replay(self._ref, "contains", key)
+
+    def __iter__(self):
+        return iter(self._session.replay(self._ref, "iter"))
+
+    def __len__(self):
+        return self._session.replay(self._ref, "len")
+
+    def __bool__(self):
+        return self._session.replay(self._ref, "bool")
+
+    def __str__(self):
+        return self._session.replay(self._ref, "str")
+
+class SessionReplayer:
+    """
+    A backend for APTManager that answers from a log written by
+    SessionRecorder instead of a real package database.
+
+    Identical requests are answered in the order they were recorded.
+    Nothing is downloaded or installed and 'apt-get update' is
+    never run, see APTManager.
+    """
+    offline = True
+    stateless = True
+
+    def __init__(self, path):
+        self._dir = os.path.dirname(os.path.abspath(path))
+        self._answers = {}
+        self._methods = set()
+        self._opens = []
+        self.calls = []
+
+        with open(path) as file:
+            for line in file:
+                entry = json.loads(line)
+                op = entry["op"]
+
+                if op == "start":
+                    if entry["version"] != SessionRecorder.version:
+                        raise ValueError("Unsupported session log version {}".format(entry["version"]))
+
+                    self._use_status(entry["status"])
+                elif op == "open":
+                    self._opens.append(entry["ref"])
+                elif op == "api":
+                    self.calls.append(entry)
+                else:
+                    if op == "call":
+                        self._methods.add((entry["ref"], entry["name"]))
+
+                    self._answers.setdefault(self._key(entry), []).append(entry)
+
+        for answers in self._answers.values():
+            answers.reverse()
+
+        self._opens.reverse()
+
+    def __call__(self):
+        if not self._opens:
+            raise ReplayMismatch("The cache was opened more often than recorded")
+
+        return ReplayedObject(self, self._opens.pop())
+
+    @staticmethod
+    def _key(entry):
+        return json.dumps(
+            [entry["ref"], entry["op"], entry["name"], entry.get("args"), entry.get("kwargs")],
+            sort_keys=True
+        )
+
+    def _use_status(self, name):
+        # read_dpkg_status() looks there
+        apt_pkg.config.set("Dir::State::status", os.path.join(self._dir, name))
+
+    def _decode(self, value):
+        if isinstance(value, dict):
+            if "ref" in value:
+                return ReplayedObject(self, value["ref"])
+
+            return [self._decode(item) for item in value["list"]]
+
+        return value
+
+    def is_method(self, ref, name):
+        return (ref, name) in self._methods
+
+    def replay(self, ref, op, name=None, call_args=None):
+        entry = {"op": op, "ref": ref, "name": name}
+
+        if call_args is not None:
+            entry["args"], entry["kwargs"] = encode_session_args(*call_args)
+
+        try:
+            entry = self._answers[self._key(entry)].pop()
+        except (KeyError, IndexError):
+            raise ReplayMismatch("{} {!r} on #{} was not recorded".format(op, name, ref)) from None
+
+        if "status" in entry:
+            self._use_status(entry["status"])
+
+        if "error" in entry:
+            exc = getattr(apt.cache, entry["error"], None) or getattr(builtins, entry["error"], None)
+
+            if not (isinstance(exc, type) and issubclass(exc, Exception)):
+                exc = SystemError
+
+            raise exc(entry["message"])
+
+        return self._decode(entry["result"])
+
+class APTManager:
+    """
+    A wrapper class for operations with aptitude
+    """
+    sources_file = "/etc/apt/sources.list.d/katoolin3.list"
+    mirror = "http://http.kali.org/kali"
+    suite = "kali-rolling"
+    components = "main contrib non-free"
+
+    def __init__(self, silent=False, refresh=False, ttl=None, scoped=True, background=False,
+                 batch_size=0, prefetch_budget=1 << 30, bundle=None, mirror=None,
+                 backend=apt.Cache, lock_timeout=600, shared=False):
+        self._cache = None
+        # A callable that returns apt.Cache or something that behaves like it:
+        self._backend = backend
+        # Backends that replay a session must not touch the system:
+        self._offline = getattr(backend, "offline", False)
+        # Backends that record or replay one build everything from the cache:
+        self._stateless = getattr(backend, "stateless", False)
+        self._signature = None
+        # Package states read from dpkg after a transaction:
+        self._status = {}
+        self._touched = set()
+        self._stale = False
+        self._success_code = 0
+        self._silent = silent
+        self._refresh = refresh
+        self._scoped = scoped
+        # katoolin3d owns the sources file and the Kali lists:
+        self._shared = shared
+
+        if mirror is not None:
+            self.mirror = mirror
+
+        # A directory created by export_bundle() that replaces the mirror:
+        self._bundle = None if bundle is None else os.path.abspath(bundle)
+
+        if self._bundle is None:
+            self._freshness = IndexFreshness(self.mirror, self.suite, ttl)
+        else:
+            # Reading a local directory is cheaper than checking freshness
+            self._refresh = True
+            self._freshness = IndexFreshness("file:" + self._bundle, ".", ttl)
+
+        self._snapshot = PackageSnapshot(self._freshness)
+        # Loading the cache in the background:
+        self._background = background
+        self._worker = None
+        self._worker_error = None
+        self._worker_lock = threading.Lock()
+        self._search_index = None
+        # Splitting up install_all():
+        self._batch_size = batch_size
+        self._prefetch_budget = prefetch_budget
+        # Waiting for other package managers:
+        self._locks = AptLocks(lock_timeout)
+        # Jobs that change the cache, see exclusive():
+        self._exclusive_lock = threading.Lock()
+        self._exclusive_owner = None
+        # Held while a cache is read or handed over, see _reading():
+        self._cache_lock = threading.RLock()
+        self._reader_cache = None
+        # libapt crashes if two threads open a cache at the same time:
+        self._open_lock = threading.Lock()
+
+    def _source_line(self):
+        options = []
+        arch = detect_arch()
+
+        if arch:
+            options.append("arch={}".format(arch))
+
+        if self._bundle is not None:
+            # The bundle is a flat repository without a signature
+            options.append("trusted=yes")
+            source = "file:{} ./".format(self._bundle)
+        else:
+            source = "{} {} {}".format(self.mirror, self.suite, self.components)
+
+        if options:
+            return "deb [{}] {}\n".format(" ".join(options), source)
+
+        return "deb {}\n".format(source)
+
+    def __enter__(self):
+        """
+        Installs the sources file and updates the APT cache
+        unless the Kali indexes are still fresh. If the sources
+        are shared with katoolin3d its lists are used as they are.
+        """
+        if not self._shared:
+            try:
+                with open(self.sources_file, "w") as file:
+                    file.write("# This file was automatically created by katoolin3. DO NOT MODIFY\n")
+                    file.write(self._source_line())
+            except OSError as e:
+                raise VisibleError() from e
+
+        if self._background:
+            with self._worker_lock:
+                self._worker = threading.Thread(target=self._warm_up, daemon=True)
+                self._worker.start()
+        else:
+            self._load()
+
+        return self
+
+    def __exit__(self, *nil):
+        try:
+            self._wait_ready()
+        except VisibleError:
+            # Clean up anyways
+            pass
+
+        if self._shared:
+            # The daemon still needs them
+            if self._cache is not None:
+                self._cache.close()
+
+            return
+
+        if self._bundle is None:
+            self._freshness.stash()
+
+        try:
+            os.remove(self.sources_file)
+        except OSError as e:
+            raise VisibleError() from e
+        finally:
+            if self._cache is not None:
+                self._cache.close()
+
+            if self._scoped:
+                # Nothing else was refreshed so only the
+                # Kali lists have to go away
+                self._freshness.drop()
+            else:
+                # Refresh everything else after we're gone
+                DeferredUpdate(self._locks).request()
+
+    def __getitem__(self, item):
+        """
+        This is used to retrieve a package by name.
+        """
+        self._wait_ready()
+        return self._cache[item]
+
+    def _load(self):
+        if self._offline or self._shared and not self._refresh:
+            self._flush()
+        elif self._refresh or not self._freshness.restore():
+            self._update()
+        else:
+            self._flush()
+
+    def _warm_up(self):
+        """
+        Load the package lists and the cache while
+        the user is already looking at the menu.
+        """
+        try:
+            self._load()
+        except Exception as e:
+            # E.g. a SystemError from opening the cache, _wait_ready() shows it
+            self._worker_error = e
+
+    def _wait_ready(self):
         """
-        This is used to retrieve a package by name.
+        Block until the cache has been loaded in the background.
+        Everything that needs package information has to call this.
         """
-        return self._cache[item]
+        with self._worker_lock:
+            if self._worker is not None:
+                if self._worker.is_alive():
+                    report("Waiting for the package lists to load...")
+                    self._worker.join()
 
-    def flush(self):
+                self._worker = None
+
+        error = self._worker_error
+
+        if isinstance(error, VisibleError):
+            raise error
+
+        if error is not None:
+            raise VisibleError() from error
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """
+        Reserve the cache for the calling thread, e.g. for a
+        transaction. Other threads read from a second cache
+        meanwhile, which shows the state from before.
+
+        This waits for the threads that are still reading
+        the cache, apt_pkg objects aren't thread-safe.
+        """
+        with self._exclusive_lock:
+            with self._cache_lock:
+                self._exclusive_owner = threading.get_ident()
+
+            try:
+                yield self
+            finally:
+                with self._cache_lock:
+                    self._exclusive_owner = None
+
+                    if self._reader_cache is not None:
+                        self._reader_cache.close()
+                        self._reader_cache = None
+
+    @contextlib.contextmanager
+    def _reading(self):
+        """
+        Return the cache the calling thread may read from
+        and keep others from changing it until it is done.
+        """
+        self._wait_ready()
+
+        with self._cache_lock:
+            owner = self._exclusive_owner
+
+            if owner is None or owner == threading.get_ident():
+                yield self._cache
+                return
+
+            if self._reader_cache is None:
+                with self._open_lock, TRACER.span("open reader cache", "cache"):
+                    self._reader_cache = self._backend()
+
+            yield self._reader_cache
+
+    def _reload(self):
         """
         Reload new package information into the cache.
 
@@ -809,109 +3006,708 @@ class APTManager:
         """
         if self._cache is not None:
             self._cache.close()
-        self._cache = apt.Cache()
+
+        with self._open_lock, TRACER.span("open cache", "cache") as span:
+            self._cache = self._backend()
+
+        METRICS.set("katoolin3_cache_load_duration_seconds", span.duration)
+        METRICS.set("katoolin3_cache_packages", len(self._cache))
+
+        self._signature = self._lists_signature()
+        self._status.clear()
+        self._touched.clear()
+        self._stale = False
+
+    def _lists_signature(self):
+        """
+        Return something that changes whenever the package
+        lists or the sources change.
+        """
+        ret = []
+        paths = [
+            apt_pkg.config.find_dir("Dir::State::lists"),
+            apt_pkg.config.find_file("Dir::Etc::sourcelist"),
+            apt_pkg.config.find_dir("Dir::Etc::sourceparts")
+        ]
+
+        for path in paths:
+            try:
+                st = os.stat(path)
+                ret.append((path, st.st_mtime_ns, st.st_size))
+
+                if os.path.isdir(path):
+                    for entry in os.scandir(path):
+                        st = entry.stat()
+                        ret.append((entry.name, st.st_mtime_ns, st.st_size))
+            except OSError:
+                pass
+
+        return ret
+
+    def _read_status(self, pkgs):
+        """
+        Read the installation state of the packages 'pkgs'
+        straight from the dpkg status file.
+        """
+        try:
+            status = read_dpkg_status(pkgs)
+        except OSError as e:
+            raise VisibleError() from e
+
+        return {name: st.installed for name, st in status.items()}
+
+    def _refresh_status(self, pkgs):
+        """
+        Update the state of the packages 'pkgs' after a
+        transaction without rebuilding the whole cache.
+        """
+        self._touched.update(pkgs)
+        self._status.update(self._read_status(pkgs))
+        # The dependency information in the cache is outdated now:
+        self._stale = True
+
+    def _make_current(self):
+        """
+        Reopen the cache before marking packages if a transaction
+        happened since it was loaded.
+
+        This is still a full reopen: python-apt can't update the
+        installed versions of a loaded cache, so the first transaction
+        after another one pays for it. Since the package lists did not
+        change, libapt reuses srcpkgcache.bin and only merges the new
+        dpkg status, which is much cheaper than parsing the lists.
+        Everything that only reads package states uses _status
+        and never gets here.
+        """
+        if self._stale:
+            with self._open_lock, TRACER.span("reopen cache", "cache"):
+                self._cache.open()
+
+            self._status.clear()
+            self._touched.clear()
+            self._stale = False
+
+    def flush(self):
+        self._wait_ready()
+        self._flush()
+
+    def _flush(self):
+        """
+        Bring the package information up to date.
+
+        The cache is only rebuilt if the package lists changed.
+        Otherwise the packages touched by previous transactions
+        are looked up again in the dpkg status file.
+        """
+        if self._cache is None or self._lists_signature() != self._signature:
+            self._reload()
+        elif self._touched:
+            self._refresh_status(list(self._touched))
+
+    def is_installed(self, pkg):
+        """
+        Return whether the package named 'pkg' is installed.
+        Raises KeyError if there is no such package.
+        """
+        self._wait_ready()
+
+        if pkg in self._status:
+            return self._status[pkg]
+
+        with self._reading() as cache:
+            return cache[pkg].is_installed
+
+    def _candidates(self):
+        """
+        Return {name: candidate version or None} for every
+        package in PACKAGES. This comes from the snapshot if
+        possible so it doesn't have to wait for the cache to load.
+        """
+        candidates = None if self._stateless else self._snapshot.load()
+
+        if candidates is not None:
+            return candidates
+
+        self._wait_ready()
+
+        candidates = {}
+
+        with self._reading() as cache:
+            # The cache of another thread must not be reloaded
+            if cache is self._cache:
+                self._flush()
+                cache = self._cache
+
+            for name in REGISTRY.names:
+                if cache.has_key(name) and cache[name].candidate is not None:
+                    candidates[name] = cache[name].candidate.version
+                else:
+                    candidates[name] = None
+
+        if not self._stateless:
+            self._snapshot.save(candidates)
+
+        return candidates
+
+    def package_states(self):
+        """
+        Return {name: PackageState} for every package in PACKAGES.
+        """
+        with TRACER.span("candidates", "status"):
+            candidates = self._candidates()
+
+        try:
+            with TRACER.span("read dpkg status", "status"):
+                status = read_dpkg_status(REGISTRY.names)
+        except OSError as e:
+            raise VisibleError() from e
+
+        return {
+            name: PackageState(
+                candidates[name] is not None,
+                status[name].installed,
+                status[name].installed
+                and candidates[name] is not None
+                and apt_pkg.version_compare(status[name].version or "", candidates[name]) < 0
+            )
+            for name in REGISTRY.names
+        }
+
+    def _scope_options(self):
+        """
+        Return the apt-get options that restrict an update
+        to the katoolin3 sources file.
+        """
+        if not self._scoped:
+            return []
+
+        return [
+            "-o", "Dir::Etc::SourceList={}".format(self.sources_file),
+            "-o", "Dir::Etc::SourceParts=-",
+            # Keep the lists of all the other sources:
+            "-o", "APT::Get::List-Cleanup=0"
+        ]
 
     def update(self):
-        if os.system(
-                "apt-get -m -y {} update".format("-qq" if self._silent else "-q")
-        ) != self._success_code:
-            raise VisibleError() from APTException("Apt update failed")
+        self._wait_ready()
+        self._update()
+
+    def _update(self):
+        cmd = ["apt-get", "-m", "-y", "-qq" if self._silent else "-q"]
+        cmd += self._scope_options()
+        cmd.append("update")
+        # Don't scribble over the menu, like apt-get below
+        self._locks.wait(AptLocks.lists_paths(), quiet=self._background)
+
+        with TRACER.span("apt-get update", "update", scoped=self._scoped) as span:
+            if self._background:
+                # Don't scribble over the menu
+                r = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            else:
+                r = subprocess.run(cmd)
+
+        METRICS.set("katoolin3_update_duration_seconds", span.duration)
+
+        if r.returncode != self._success_code:
+            msg = "Apt update failed"
+
+            if r.stderr:
+                msg += " ({})".format(r.stderr.decode("utf-8", errors="ignore").strip())
+
+            raise VisibleError() from APTException(msg)
 
-        self.flush()
+        if not self._scoped:
+            # A refresh requested by an earlier run is done now
+            DeferredUpdate(self._locks).satisfied()
+
+        # The state directory belongs to the Kali mirror
+        if self._bundle is None:
+            self._freshness.record()
+
+        self._flush()
 
     def install(self, pkgs):
         """
         Install packages from iterator 'pkgs'
         """
+        pkgs = list(pkgs) # consumed twice
+        self._wait_ready()
+
         if self._cache.dpkg_journal_dirty:
             raise VisibleError() from Exception("Your dpkg is in an unsafe state. Run 'sudo dpkg --configure -a' to fix this.")
 
-        print("Reading package lists...")
+        report("Reading package lists...")
+        self._make_current()
         num = 0
 
         for pkg in pkgs:
             try:
-                if not self._cache[pkg].is_installed:
-                    self._cache[pkg].mark_install()
+                if not self.is_installed(pkg):
+                    self._mark_install(pkg)
 
                     if self._cache[pkg].marked_install:
                         num += 1
             except KeyError:
-                print("Warning: Could not find package '{}'".format(pkg))
+                report("Warning: Could not find package '{}'".format(pkg))
+                METRICS.add("katoolin3_skipped_packages", 1)
             except SystemError as s:
-                print("Error with package {}: {}".format(pkg, s))
-                print("Trying to ignore this...")
+                report("Error with package {}: {}".format(pkg, s))
+                report("Trying to ignore this...")
+                METRICS.add("katoolin3_failed_packages", 1)
                 self._cache[pkg].mark_delete()
 
         if num == 0:
             raise StepBack("Nothing to install")
 
-        print("Installing {} package{}...".format(num, 's' if num > 1 else ''))
+        report("Installing {} package{}...".format(num, 's' if num > 1 else ''))
+        category = self._transaction_category(pkgs)
 
         try:
-            self._cache.commit(fetch_progress=apt.progress.text.AcquireProgress())
+            self._commit_marked(fetch_progress=FetchProgress(category), install_progress=DpkgProgress(category))
         except SystemError as s:
             raise VisibleError() from APTException("Installation of some packages failed ({})".format(s))
 
-        self.flush()
+    @staticmethod
+    def _package_category(pkg):
+        """
+        Return the category 'pkg' is accounted to in the metrics.
+        """
+        cats = REGISTRY.categories(pkg)
+        return cats[0] if cats else "none"
+
+    def _transaction_category(self, pkgs):
+        """
+        Return the category of a transaction or "mixed"
+        if its packages are from several categories.
+        """
+        cats = {self._package_category(pkg) for pkg in pkgs}
+        return cats.pop() if len(cats) == 1 else "mixed"
+
+    def _mark_install(self, pkg):
+        """
+        Mark 'pkg' for installation and account for the time it took.
+        """
+        span = TRACER.span(pkg, "mark")
+
+        try:
+            with span:
+                self._cache[pkg].mark_install()
+        finally:
+            METRICS.add("katoolin3_mark_duration_seconds", span.duration, category=self._package_category(pkg))
+
+    def _commit_marked(self, **kwargs):
+        """
+        Commit the marked changes and look up the
+        new state of the affected packages afterwards.
+        """
+        changes = [pkg.name for pkg in self._cache.get_changes()]
+
+        if not self._offline:
+            try:
+                self._locks.wait(AptLocks.dpkg_paths())
+            except VisibleError:
+                # The next transaction must not inherit the marks
+                self._cache.clear()
+                raise
+
+        try:
+            with TRACER.span("commit", "commit", packages=len(changes)):
+                try:
+                    self._cache.commit(**kwargs)
+                finally:
+                    # Every B event of the trace needs its E event
+                    for progress in kwargs.values():
+                        progress.end_span()
+        finally:
+            self._refresh_status(changes)
+
+    def _archives(self, pkgs):
+        """
+        Return the archives that have to be downloaded
+        to install 'pkgs'. This clears all marks.
+
+        The marks aren't traced or counted, 'pkgs' is marked
+        again for real when it is installed.
+        """
+        ret = []
+
+        if self._try_marks(pkgs, traced=False):
+            for pkg in self._cache.get_changes():
+                if pkg.marked_delete:
+                    continue
+
+                ver = pkg.candidate
+                ret.append(Archive(
+                    ver.uri,
+                    ArchivePrefetcher.archive_name(pkg.shortname, ver.version, ver.architecture),
+                    ver.size,
+                    ver.sha256
+                ))
+
+        self._cache.clear()
+        return ret
+
+    def _try_marks(self, pkgs, traced=True):
+        """
+        Mark all packages in 'pkgs' for installation on a clean slate.
+        Returns False if that is not possible without breakage.
+        Unless 'traced' is set the marks don't show up in the trace
+        and the metrics.
+        """
+        self._cache.clear()
+        category = None
+
+        try:
+            for pkg in pkgs:
+                if traced:
+                    # Group the spans by the first category of the packages
+                    cats = REGISTRY.categories(pkg)
+
+                    if cats[:1] != category:
+                        if category:
+                            TRACER.end(category[0], "category")
+
+                        category = cats[:1]
+
+                        if category:
+                            TRACER.begin(category[0], "category")
+
+                    self._mark_install(pkg)
+                else:
+                    self._cache[pkg].mark_install()
+
+                if not self._cache[pkg].marked_install:
+                    return False
+        except SystemError:
+            return False
+        finally:
+            if category:
+                TRACER.end(category[0], "category")
+
+        return self._cache.broken_count == 0
+
+    def _split_markable(self, base, pkgs):
+        """
+        Bisect 'pkgs' into (good, bad) where 'good' can be marked
+        together with 'base' and every package in 'bad' breaks
+        the transaction.
+        """
+        if self._try_marks(base + pkgs):
+            return pkgs, []
+
+        if len(pkgs) == 1:
+            return [], pkgs
+
+        mid = len(pkgs) // 2
+        good_left, bad_left = self._split_markable(base, pkgs[:mid])
+        good_right, bad_right = self._split_markable(base + good_left, pkgs[mid:])
+        return good_left + good_right, bad_left + bad_right
+
+    def install_all(self, pkgs):
+        """
+        Install a large selection of packages in as few
+        transactions as possible.
+
+        Everything is tried in one transaction first. If marking
+        or committing fails the selection gets bisected until the
+        culprits are isolated and the rest is installed anyway.
+        Returns the packages that could not be installed.
+
+        If a batch size is set the selection is installed in batches
+        of that size instead, and the archives of the next batch are
+        downloaded while dpkg installs the current one.
+
+        dpkg triggers are run only once after the last transaction.
+        """
+        self._wait_ready()
+
+        if self._cache.dpkg_journal_dirty:
+            raise VisibleError() from Exception("Your dpkg is in an unsafe state. Run 'sudo dpkg --configure -a' to fix this.")
+
+        report("Reading package lists...")
+        self._make_current()
+        todo = []
+
+        for pkg in dict.fromkeys(pkgs):
+            if not self._cache.has_key(pkg):
+                report("Warning: Could not find package '{}'".format(pkg))
+                METRICS.add("katoolin3_skipped_packages", 1)
+            elif not self.is_installed(pkg):
+                todo.append(pkg)
+
+        if not todo:
+            raise StepBack("Nothing to install")
+
+        report("Resolving dependencies of {} packages...".format(len(todo)))
+        good, failed = self._split_markable([], todo)
+
+        for pkg in failed:
+            report("Error with package {}: cannot be installed, skipping it".format(pkg))
+
+        if self._batch_size:
+            batches = [
+                good[i:i + self._batch_size]
+                for i in range(0, len(good), self._batch_size)
+            ]
+        else:
+            batches = [good] if good else []
+
+        if self._offline:
+            self._install_batches(batches, failed)
+        else:
+            with DeferredTriggers(self._locks):
+                self._install_batches(batches, failed)
+
+        METRICS.add("katoolin3_failed_packages", len(failed))
+        self._cache.clear()
+        return failed
+
+    def _install_batches(self, batches, failed):
+        """
+        Commit 'batches' one after the other. Batches that fail
+        are split up again, packages that can't be installed
+        on their own are appended to 'failed'.
+
+        Only a package whose commit failed on its own or that
+        can't be marked anymore counts as failed.
+        """
+        while batches:
+            batch = batches.pop(0)
+            self._make_current()
+            batch = [pkg for pkg in batch if not self.is_installed(pkg)]
+
+            if not batch:
+                continue
+
+            prefetcher = ArchivePrefetcher(self._prefetch_budget)
+
+            if self._batch_size and batches:
+                archives = self._archives(batches[0])
+
+                if not self._offline:
+                    prefetcher.start(archives)
+
+            if not self._try_marks(batch):
+                # Only possible after a partially failed commit,
+                # the rest of the batch is tried again without the culprits
+                prefetcher.stop()
+                good, bad = self._split_markable([], batch)
+
+                for pkg in bad:
+                    report("Error with package {}: cannot be installed anymore, skipping it".format(pkg))
+
+                failed += bad
+
+                if good:
+                    batches.insert(0, good)
+
+                continue
+
+            report("Installing {} package{}...".format(len(batch), 's' if len(batch) > 1 else ''))
+            category = self._transaction_category(batch)
+
+            try:
+                self._commit_marked(
+                    fetch_progress=FetchProgress(category),
+                    install_progress=DpkgProgress(category, prefetcher.dpkg_started)
+                )
+            except (SystemError, apt.cache.FetchFailedException) as s:
+                report("Installation of some packages failed ({})".format(s))
+
+                if self._cache.dpkg_journal_dirty:
+                    raise VisibleError() from Exception("Your dpkg is in an unsafe state. Run 'sudo dpkg --configure -a' to fix this.")
+
+                if len(batch) == 1:
+                    failed += batch
+                else:
+                    report("Splitting the transaction to find the culprit...")
+                    mid = len(batch) // 2
+                    batches[:0] = [batch[:mid], batch[mid:]]
+            finally:
+                prefetcher.stop()
+
+    def _pick_alternative(self, dep):
+        """
+        Return the name of the first alternative of dependency
+        'dep' whose candidate version satisfies it or None.
+        Virtual packages only satisfy unversioned dependencies.
+        """
+        for alt in dep.or_dependencies:
+            if self._cache.has_key(alt.name):
+                ver = self._cache[alt.name].candidate
+
+                if ver is not None and (not alt.version or apt_pkg.check_dep(ver.version, alt.relation, alt.version)):
+                    return alt.name
+            elif not alt.version and self._cache.get_providing_packages(alt.name):
+                return alt.name
+
+        return None
+
+    def _closure(self, pkgs):
+        """
+        Return the candidate versions of 'pkgs' and of everything
+        they depend on. Installed packages are included as well
+        since the target machine might not have them.
+        """
+        ret = {}
+        todo = list(pkgs)
+
+        while todo:
+            name = todo.pop()
+
+            if name in ret:
+                continue
+
+            if not self._cache.has_key(name):
+                providers = self._cache.get_providing_packages(name)
+
+                if not providers:
+                    report("Warning: Could not find package '{}'".format(name))
+                    continue
+
+                name = providers[0].name
+
+                if name in ret:
+                    continue
+
+            ver = self._cache[name].candidate
+
+            if ver is None:
+                report("Warning: Package '{}' has no installable version".format(name))
+                continue
+
+            ret[name] = ver
+
+            for dep in ver.dependencies:
+                alt = self._pick_alternative(dep)
+
+                if alt is None:
+                    report("Warning: Nothing satisfies '{}' of '{}'".format(dep.rawstr, name))
+                else:
+                    todo.append(alt)
+
+        return list(ret.values())
+
+    def export_bundle(self, pkgs, directory):
+        """
+        Download 'pkgs' with all their dependencies into 'directory'
+        and turn it into a flat repository that can be passed
+        as 'bundle' to another APTManager.
+        """
+        self._wait_ready()
+        report("Resolving dependencies...")
+        versions = self._closure(pkgs)
+
+        if not versions:
+            raise StepBack("Nothing to export")
+
+        report("Downloading {} package{}...".format(len(versions), 's' if len(versions) > 1 else ''))
+        stanzas = []
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+
+            for ver in sorted(versions, key=lambda v: v.package.name):
+                path = ver.fetch_binary(directory, progress=apt.progress.text.AcquireProgress())
+                stanza = []
+
+                for line in str(ver.record).rstrip("\n").split("\n"):
+                    if line.startswith("Filename:"):
+                        line = "Filename: ./{}".format(os.path.basename(path))
+
+                    stanza.append(line)
+
+                stanzas.append("\n".join(stanza) + "\n\n")
+
+            self._write_index(directory, "".join(stanzas).encode("utf-8"))
+        except (OSError, apt.cache.FetchFailedException) as e:
+            raise VisibleError() from e
+
+        raise StepBack("Exported {} packages to {}".format(len(versions), directory))
+
+    def _write_index(self, directory, packages):
+        """
+        Write the Packages and Release files of a bundle.
+        """
+        files = {
+            "Packages": packages,
+            "Packages.gz": gzip.compress(packages)
+        }
+        release = [
+            "Origin: katoolin3",
+            "Label: katoolin3 bundle",
+            "Date: {}".format(email.utils.formatdate(usegmt=True)),
+            "SHA256:"
+        ]
+
+        for name, data in files.items():
+            with open(os.path.join(directory, name), "wb") as file:
+                file.write(data)
+
+            release.append(" {} {} {}".format(hashlib.sha256(data).hexdigest(), len(data), name))
+
+        with open(os.path.join(directory, "Release"), "w") as file:
+            file.write("\n".join(release) + "\n")
 
     def remove(self, pkgs):
         """
         Uninstall packages in iterator 'pkgs'
         """
+        pkgs = list(pkgs) # consumed twice
+        self._wait_ready()
+
         if self._cache.dpkg_journal_dirty:
             raise VisibleError() from Exception("Your dpkg is in an unsafe state. Run 'sudo dpkg --configure -a' to fix this.")
 
-        print("Reading package lists...")
+        report("Reading package lists...")
+        self._make_current()
         num = 0
 
         for pkg in pkgs:
             try:
-                if self._cache[pkg].is_installed:
+                if self.is_installed(pkg):
                     self._cache[pkg].mark_delete()
                     num += 1
             except KeyError:
-                print("Warning: Could not find package '{}'".format(pkg))
+                report("Warning: Could not find package '{}'".format(pkg))
             except SystemError as e:
                 raise VisibleError() from e
 
         if num == 0:
             raise StepBack("Nothing to remove")
 
-        print("Removing {} package{}...".format(num, 's' if num > 1 else ''))
+        report("Removing {} package{}...".format(num, 's' if num > 1 else ''))
 
         try:
-            self._cache.commit()
+            self._commit_marked(install_progress=DpkgProgress(self._transaction_category(pkgs)))
         except SystemError as s:
             raise VisibleError() from APTException("Removal failed: " + str(s))
 
-        self.flush()
-
     def has_package(self, pkg):
-        return self._cache.has_key(pkg)
+        with self._reading() as cache:
+            return cache.has_key(pkg)
 
     def _pkg_status(self, pkg):
         """
         Return information about the status of a package.
         pkg = Package object
         """
-        if pkg.is_installed:
+        if self._status.get(pkg.name, pkg.is_installed):
             yield "Installed"
         else:
             yield "Not installed"
 
-        if pkg.is_upgradable:
+        # The cache doesn't know about packages that changed
+        # in this session but those are up to date anyway:
+        if pkg.name not in self._status and pkg.is_upgradable:
             yield "Not up to date"
 
     def _pkg_categories(self, pkg):
         """
-        Return the categories where a package is in (1 or more).
+        Return the categories where a package is in.
         pkg = package name as string
         """
-        for cat in PACKAGES:
-            if pkg in PACKAGES[cat]:
-                yield cat
-                continue
+        return REGISTRY.categories(pkg)
 
     def _pkg_versions(self, pkg):
         """
@@ -942,35 +3738,148 @@ class APTManager:
 
         return ret
 
+    def info(self, name):
+        """
+        Return information about a package as a dict.
+        Raises KeyError if there is no such package.
+        """
+        with self._reading() as cache:
+            pkg = cache[name]
+
+            return {
+                "package": name,
+                "categories": list(self._pkg_categories(name)),
+                "status": list(self._pkg_status(pkg)),
+                "versions": list(self._pkg_versions(pkg)),
+                "depends": list(self._pkg_depends(pkg)),
+                "homepage": pkg.candidate.homepage,
+                "origins": sorted(self._pkg_origins(pkg)),
+                "description": pkg.candidate.description
+            }
+
     def show(self, pkg):
         """
         Display some information about a package.
         """
-        print("Package: ", pkg)
+        print_info(self.info(pkg))
+
+    def plan(self, install=(), remove=()):
+        """
+        Work out what installing 'install' and removing 'remove'
+        would do without changing anything.
+
+        Returns a dict with the packages that would be installed
+        or removed, the dependencies that come along, the packages
+        that can't be installed, unknown names, names that are
+        already in the requested state and the download size.
+        """
+        self._wait_ready()
+        self._make_current()
+        ret = {
+            "install": [],
+            "dependencies": [],
+            "remove": [],
+            "failed": [],
+            "missing": [],
+            "unchanged": [],
+            "download_bytes": 0
+        }
+        todo = []
+
+        for pkg in dict.fromkeys(install):
+            if not self._cache.has_key(pkg):
+                ret["missing"].append(pkg)
+            elif self.is_installed(pkg):
+                ret["unchanged"].append(pkg)
+            else:
+                todo.append(pkg)
+
+        for pkg in dict.fromkeys(remove):
+            if not self._cache.has_key(pkg):
+                ret["missing"].append(pkg)
+            elif self.is_installed(pkg):
+                ret["remove"].append(pkg)
+            else:
+                ret["unchanged"].append(pkg)
+
+        ret["install"], ret["failed"] = self._split_markable([], todo)
+
+        if ret["install"] and self._try_marks(ret["install"]):
+            wanted = set(ret["install"])
+
+            for pkg in self._cache.get_changes():
+                if pkg.marked_delete:
+                    continue
+
+                ret["download_bytes"] += pkg.candidate.size
+
+                if pkg.name not in wanted:
+                    ret["dependencies"].append(pkg.name)
+
+        ret["dependencies"].sort()
+        self._cache.clear()
+        return ret
+
+    def _search_key(self):
+        """
+        Return something that changes whenever the package lists change.
+        """
+        lists_dir = apt_pkg.config.find_dir("Dir::State::lists")
+
+        try:
+            return sorted(
+                (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                for entry in os.scandir(lists_dir)
+                if entry.is_file() and entry.name != "lock"
+            )
+        except OSError:
+            return None
+
+    def search_index(self):
+        """
+        Return the SearchIndex for the current package lists.
+        """
+        self._wait_ready()
+        key = self._search_key()
+
+        if self._search_index is None or self._search_index.key != key:
+            self._search_index = None if self._stateless else SearchIndex.load(key)
+
+            if self._search_index is None:
+                report("Building the search index...")
+
+                with self._reading() as cache:
+                    self._search_index = SearchIndex.build(key, cache)
 
-        if pkg in all_packages():
-            print("Category:", ", ".join(self._pkg_categories(pkg)))
+                if not self._stateless:
+                    self._search_index.save()
 
-        pkg = self._cache[pkg]
+        return self._search_index
 
-        print("Status:  ", ", ".join(self._pkg_status(pkg)))
-        print("Version: ", ", ".join(self._pkg_versions(pkg)))
-        print("Depends: ", ", ".join(self._pkg_depends(pkg)))
-        print("Homepage:", pkg.candidate.homepage)
-        print("Repo:    ", ", ".join(self._pkg_origins(pkg)))
-        print(textwrap.fill(pkg.candidate.description, width=50))
-        print()
+    def search_hits(self, key):
+        """
+        Search for keywords in the apt cache and return
+        the best matches as a list of dicts.
+        """
+        if not key.strip():
+            return []
+
+        return [
+            {
+                "name": hit.name,
+                "summary": hit.summary,
+                "score": hit.score,
+                "categories": list(self._pkg_categories(hit.name))
+            }
+            for hit in self.search_index().query(key)
+        ]
 
     def search(self, key):
         """
-        Search for keywords in the apt cache.
-
-        I haven't found a solution with the APT-API.
+        Search for keywords in the apt cache and print the best matches.
         """
-        key = shlex.quote(key)
-
-        if key:
-            os.system("apt search -qq {};".format(key))
+        if key.strip():
+            print_search_hits(self.search_hits(key))
 
 def detect_arch(default=""):
     """
@@ -988,6 +3897,54 @@ def detect_arch(default=""):
     except KeyError:
         return default
 
+# Used by read_dpkg_status():
+DPKG_PACKAGE_RE = re.compile(rb"^Package: (\S+)$", re.MULTILINE)
+DPKG_STATUS_RE = re.compile(rb"^Status: (.*)$", re.MULTILINE)
+DPKG_VERSION_RE = re.compile(rb"^Version: (\S+)$", re.MULTILINE)
+
+def read_dpkg_status(names, path=None):
+    """
+    Return {name: DpkgStatus} for all 'names' without going through
+    libapt. The status file is scanned once through a memory map
+    and the scan stops as soon as every name has been found installed.
+    """
+    if path is None:
+        path = apt_pkg.config.find_file("Dir::State::status")
+
+    ret = {name: DpkgStatus(False, None) for name in names}
+    pending = set(names)
+
+    with open(path, "rb") as file:
+        try:
+            status = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return ret
+
+    with status:
+        for match in DPKG_PACKAGE_RE.finditer(status):
+            name = match.group(1).decode("utf-8", errors="ignore")
+
+            if name not in pending:
+                continue
+
+            end = status.find(b"\n\n", match.end())
+            stanza = status[match.end():end if end >= 0 else len(status)]
+            state = DPKG_STATUS_RE.search(stanza)
+
+            # Multi-arch packages can show up more than once
+            if state is None or not state.group(1).endswith(b" installed"):
+                continue
+
+            version = DPKG_VERSION_RE.search(stanza)
+            ret[name] = DpkgStatus(True, version.group(1).decode() if version else None)
+            pending.discard(name)
+
+            if not pending:
+                break
+
+    return ret
+
 def print_logo():
     """
     The obligatory ascii art
@@ -1024,6 +3981,11 @@ followed by a '?'.
 If the list of options gets out of sight type '!!'
 to print it again.
 
+If you are looking for a specific package type '/'
+and start typing its name. The list gets narrowed down
+with every key you press. '/' followed by a name
+does the same in one go.
+
 Packages which you have already installed are shown
 in {}this color{}.
 """.format(Terminal.black, Terminal.reset))
@@ -1045,32 +4007,54 @@ def packages_by_category(cat):
     for pkg in PACKAGES[cat]:
         yield pkg
 
+def resolve_selection(names):
+    """
+    Expand a list of category and package names into package names.
+    """
+    for name in names:
+        if name in PACKAGES:
+            yield from packages_by_category(name)
+        else:
+            yield name
+
+def start_job(title, func, *args):
+    """
+    Run 'func(*args)' as a background job and go back to the menu.
+    """
+    job = JOBS.submit(title, func, *args)
+    raise StepBack("Started job #{}: {} (see 'Jobs' in the main menu)".format(job.number, title))
+
+def describe_packages(verb, pkgs):
+    """
+    Return a title for a job that works on 'pkgs'.
+    """
+    if len(pkgs) > 3:
+        return "{} {} packages".format(verb, len(pkgs))
+
+    return "{} {}".format(verb, ", ".join(pkgs))
+
+def install_everything():
+    # Installing a large amount of packages in one go can make
+    # python apt throw an exception. install_all() takes care of
+    # that by splitting off the packages that cause it.
+    failed = APT.install_all(all_packages())
+
+    if failed:
+        report(f'{Terminal.red}Could not install: {", ".join(sorted(failed))}{Terminal.reset}')
+
+    raise StepBack("Finished installing all packages")
+
+def remove_everything():
+    APT.remove(all_packages())
+    raise StepBack("Removed all packages")
+
 def install_all_packages():
     sel = Selection("Install everything?")
     sel.add_choice("Yes", True)
     sel.add_choice("No", False)
 
     if sel.get_choice():
-        black = Terminal.black
-        green = Terminal.green
-
-        print_heading(f'Installing all packages')
-
-        # Installing a large amount of packages in one go causes the python apt
-        # library to throw an exception. To avoid this we process packages in
-        # batches grouped by category.
-        for cat in PACKAGES:
-            try:
-                print()
-                print_heading(f'Installing all packages in the "{cat}" category')
-                APT.install(packages_by_category(cat))
-                print_heading(f'Finished installing all packages in the "{cat}" category')
-            except StepBack as s:
-                if s.has_message():
-                    print(s)
-                continue
-
-        raise StepBack(f'{green}Finished installing all packages{black}')
+        start_job("Install all packages", install_everything)
 
 def delete_all_packages():
     sel = Selection("Delete everything?")
@@ -1078,8 +4062,7 @@ def delete_all_packages():
     sel.add_choice("No", False)
 
     if sel.get_choice():
-        APT.remove(all_packages())
-        raise StepBack("Removed all packages")
+        start_job("Remove all packages", remove_everything)
 
 def nice_name(pkg):
     """
@@ -1101,6 +4084,8 @@ def nice_name(pkg):
 
     return " ".join(parts).title()
 
+REGISTRY = PackageRegistry(PACKAGES)
+
 def view_packages(cat):
     """
     Display the submenu for installing packages
@@ -1108,17 +4093,18 @@ def view_packages(cat):
     """
     while True:
         sel = Selection("Select a Package")
+        states = APT.package_states()
 
-        for pkg in sorted(PACKAGES[cat]):
-            nice_pkg = nice_name(pkg)
+        for pkg in REGISTRY.category(cat):
+            nice_pkg = REGISTRY[pkg].nice_name
 
-            try:
-                if APT[pkg].is_installed:
-                    sel.add_choice(nice_pkg, pkg, Terminal.black)
-                else:
-                    sel.add_choice(nice_pkg, pkg)
-            except KeyError:
-                pass
+            if not states[pkg].available:
+                continue
+
+            if states[pkg].installed:
+                sel.add_choice(nice_pkg, pkg, Terminal.black)
+            else:
+                sel.add_choice(nice_pkg, pkg)
 
         if len(sel) > 1:
             sel.add_choice("ALL", Selection.ALL)
@@ -1126,7 +4112,11 @@ def view_packages(cat):
         sel.add_choice("BACK", Selection.BACK)
 
         choices = sel.get_choices()
-        method = APT.install if isinstance(choices, InstallList) else APT.remove
+
+        if isinstance(choices, InstallList):
+            verb, method = "Install", APT.install
+        else:
+            verb, method = "Remove", APT.remove
 
         try:
             if len(choices) == 1:
@@ -1146,7 +4136,7 @@ def view_packages(cat):
                 print("Invalid selection")
                 continue
 
-            method(choices)
+            start_job(describe_packages(verb, choices), method, list(choices))
 
         except VisibleError as v:
             print(v)
@@ -1185,31 +4175,25 @@ def view_categories():
                 print(s)
 
 def list_installed_packages():
-    APT.flush()
+    states = APT.package_states()
 
-    for pkg in sorted(set(all_packages())):
-        try:
-            if APT[pkg].is_installed:
-                print(nice_name(pkg))
-        except KeyError:
-            pass
+    for pkg in REGISTRY.sorted_names:
+        if states[pkg].available and states[pkg].installed:
+            print(REGISTRY[pkg].nice_name)
 
 def list_not_installed_packages():
-    APT.flush()
+    states = APT.package_states()
 
-    for pkg in sorted(set(all_packages())):
-        try:
-            if not APT[pkg].is_installed:
-                print(nice_name(pkg))
-        except KeyError:
-            pass
+    for pkg in REGISTRY.sorted_names:
+        if states[pkg].available and not states[pkg].installed:
+            print(REGISTRY[pkg].nice_name)
 
 def search():
     """
     Searches the APT cache. If the search string is
     a package name display information about the package
-    like 'apt show' otherwise treat it like a keyword for
-    'apt search'.
+    like 'apt show' otherwise search for it like
+    'apt search' would.
     """
     print()
     print("Enter a package name to get information about a package")
@@ -1222,6 +4206,35 @@ def search():
     else:
         APT.search(key)
 
+def view_jobs():
+    """
+    Displays the background jobs and the progress of one of them.
+    """
+    while True:
+        jobs = JOBS.jobs()
+
+        if not jobs:
+            raise StepBack("No jobs were started yet")
+
+        sel = Selection("Select a Job")
+
+        for job in jobs:
+            sel.add_choice(job.summary(), job)
+
+        sel.add_choice("BACK", Selection.BACK)
+        job = sel.get_choice()
+
+        if job == Selection.BACK:
+            raise StepBack()
+
+        print_heading(job.summary())
+
+        for stamp, msg in job.events:
+            print(time.strftime("%H:%M:%S", time.localtime(stamp)), msg)
+
+        if job.error is not None:
+            print(Terminal.red + job.error + Terminal.reset)
+
 def main():
     sel = Selection("Main Menu")
     sel.add_choice("View Categories", view_categories)
@@ -1230,7 +4243,8 @@ def main():
     sel.add_choice("Search repository", search)
     sel.add_choice("List installed packages", list_installed_packages)
     sel.add_choice("List not installed packages", list_not_installed_packages)
-    sel.add_choice("Install Kali Menu", lambda: APT.install(["kali-menu"]))
+    sel.add_choice("Install Kali Menu", lambda: start_job("Install kali-menu", APT.install, ["kali-menu"]))
+    sel.add_choice("Jobs", view_jobs)
     sel.add_choice("Uninstall old katoolin", lambda: handle_old_katoolin(force=True))
     sel.add_choice("Help", print_help)
     sel.add_choice("Exit", Selection.BACK)
@@ -1249,6 +4263,455 @@ def main():
         except VisibleError as v:
             print(v)
 
+class StdoutToStderr:
+    """
+    Sends everything written to stdout, including the output
+    of apt-get and dpkg, to stderr so that stdout only carries
+    the machine-readable result of a command.
+    """
+    def __enter__(self):
+        sys.stdout.flush()
+        self._saved = os.dup(1)
+        os.dup2(2, 1)
+        return self
+
+    def __exit__(self, *nil):
+        sys.stdout.flush()
+        os.dup2(self._saved, 1)
+        os.close(self._saved)
+
+def read_manifest(path):
+    """
+    Return (install, remove) from a manifest file like
+        {"install": ["Wireless Attacks", "nmap"], "remove": ["maltego"]}
+    Both lists may contain category and package names.
+    """
+    try:
+        with open(path) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError) as e:
+        raise VisibleError() from e
+
+    ret = []
+
+    for key in ("install", "remove"):
+        names = manifest.get(key, []) if isinstance(manifest, dict) else None
+
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            raise VisibleError() from ValueError("{}: '{}' must be a list of names".format(path, key))
+
+        ret.append(list(resolve_selection(names)))
+
+    return tuple(ret)
+
+def command_targets(args):
+    """
+    Return the (install, remove) package names of a command
+    from its arguments and the manifest, if there is one.
+    """
+    install, remove = read_manifest(args.manifest) if args.manifest else ([], [])
+    names = list(resolve_selection(args.names))
+
+    if args.command == "remove":
+        remove += names
+    else:
+        install += names
+
+    return install, remove
+
+def command_request(args):
+    """
+    Turn the arguments of a subcommand into a request for
+    run_request(). Manifests are read here so that the daemon
+    never opens files on behalf of a client.
+    """
+    if args.command in ("install", "remove", "plan"):
+        install, remove = command_targets(args)
+
+        return {
+            "command": "plan" if args.command == "plan" else "apply",
+            "install": install,
+            "remove": remove
+        }
+
+    if args.command == "search":
+        return {"command": "search", "text": " ".join(args.names)}
+
+    return {"command": args.command, "names": list(resolve_selection(args.names))}
+
+def run_request(request):
+    """
+    Run a request made by command_request() against APT and
+    return (result, whether it succeeded). The result can be
+    written as JSON.
+    """
+    command = request.get("command")
+
+    if command == "apply":
+        result = apply_changes(request["install"], request["remove"])
+
+        # Keep the snapshot current for the fast path of converge
+        APT.package_states()
+        return result, not result["failed"] and not result["missing"]
+
+    if command == "plan":
+        result = APT.plan(request["install"], request["remove"])
+        return result, not result["failed"] and not result["missing"]
+
+    if command == "list":
+        return package_rows(request["names"]), True
+
+    if command == "show":
+        result = []
+
+        for pkg in request["names"]:
+            try:
+                result.append(APT.info(pkg))
+            except KeyError:
+                result.append({"package": pkg, "error": "not found"})
+
+        return result, not any("error" in info for info in result)
+
+    if command == "search":
+        return APT.search_hits(request["text"]), True
+
+    raise VisibleError() from APTException("Unknown command '{}'".format(command))
+
+def apply_changes(install, remove):
+    """
+    Install 'install' and remove 'remove' against the cache
+    that is already loaded and return what happened.
+    """
+    known = [pkg for pkg in dict.fromkeys(install + remove) if APT.has_package(pkg)]
+    before = {pkg: APT.is_installed(pkg) for pkg in known}
+    result = {
+        "installed": [],
+        "removed": [],
+        "failed": [],
+        "missing": [pkg for pkg in dict.fromkeys(install + remove) if pkg not in before],
+        "unchanged": []
+    }
+
+    if any(not before[pkg] for pkg in install if pkg in before):
+        APT.install_all(pkg for pkg in install if pkg in before)
+
+    if any(before[pkg] for pkg in remove if pkg in before):
+        try:
+            APT.remove(pkg for pkg in remove if pkg in before)
+        except VisibleError as v:
+            report(v)
+
+    APT.flush()
+
+    for pkg in known:
+        now = APT.is_installed(pkg)
+        wanted = pkg in install
+
+        if now == before[pkg]:
+            result["unchanged" if now == wanted else "failed"].append(pkg)
+        else:
+            result["installed" if now else "removed"].append(pkg)
+
+    return result
+
+def converge_targets(args):
+    """
+    Diff the desired state against the dpkg status file and return
+    (install, remove, unchanged, missing). This neither updates nor
+    loads the cache: tools that the snapshot knows to be unavailable
+    are 'missing' right away.
+    """
+    install, remove = command_targets(args)
+    candidates = None
+
+    if args.bundle is None:
+        candidates = PackageSnapshot(IndexFreshness(args.mirror, APTManager.suite, args.ttl)).load()
+
+    try:
+        status = read_dpkg_status(set(install) | set(remove))
+    except OSError as e:
+        raise VisibleError() from e
+
+    ret = ([], [], [], [])
+
+    for pkg in dict.fromkeys(install):
+        if status[pkg].installed:
+            ret[2].append(pkg)
+        elif candidates is not None and pkg in candidates and candidates[pkg] is None:
+            ret[3].append(pkg)
+        else:
+            ret[0].append(pkg)
+
+    for pkg in dict.fromkeys(remove):
+        ret[1 if status[pkg].installed else 2].append(pkg)
+
+    return ret
+
+def package_rows(names):
+    """
+    Return the state of the tools, optionally only
+    of those in the given categories or with the given names.
+    """
+    states = APT.package_states()
+    names = set(names)
+
+    return [
+        {
+            "name": pkg,
+            "categories": list(REGISTRY.categories(pkg)),
+            "available": states[pkg].available,
+            "installed": states[pkg].installed,
+            "upgradable": states[pkg].upgradable
+        }
+        for pkg in REGISTRY.sorted_names
+        if not names or pkg in names
+    ]
+
+def print_changes(result):
+    for key in ("installed", "removed", "failed", "missing"):
+        if result[key]:
+            print("{}: {}".format(key.capitalize(), ", ".join(result[key])))
+
+def print_plan(result):
+    print("Install:      " + (", ".join(result["install"]) or "-"))
+    print("Dependencies: {} ({:.1f} MB to download)".format(len(result["dependencies"]), result["download_bytes"] / (1 << 20)))
+    print("Remove:       " + (", ".join(result["remove"]) or "-"))
+
+    for key in ("failed", "missing"):
+        if result[key]:
+            print("{}:{}{}".format(key.capitalize(), " " * (13 - len(key)), ", ".join(result[key])))
+
+def print_rows(rows):
+    for row in rows:
+        if not row["available"]:
+            state = "not available"
+        elif row["installed"]:
+            state = "installed, upgradable" if row["upgradable"] else "installed"
+        else:
+            state = "not installed"
+
+        print("{:<30} {:<20} {}".format(row["name"], state, ", ".join(row["categories"])))
+
+def print_info(info):
+    """
+    Print a dict returned by APTManager.info().
+    """
+    print("Package: ", info["package"])
+
+    if "error" in info:
+        print("Package not found")
+        print()
+        return
+
+    if info["categories"]:
+        print("Category:", ", ".join(info["categories"]))
+
+    print("Status:  ", ", ".join(info["status"]))
+    print("Version: ", ", ".join(info["versions"]))
+    print("Depends: ", ", ".join(info["depends"]))
+    print("Homepage:", info["homepage"])
+    print("Repo:    ", ", ".join(info["origins"]))
+    print(textwrap.fill(info["description"], width=50))
+    print()
+
+def print_search_hits(hits):
+    """
+    Print a list returned by APTManager.search_hits().
+    """
+    if not hits:
+        print("No packages found")
+
+    for hit in hits:
+        line = "{}{}{} - {}".format(Terminal.green, hit["name"], Terminal.reset, hit["summary"])
+
+        if hit["categories"]:
+            line += " {}[{}]{}".format(Terminal.yellow, ", ".join(hit["categories"]), Terminal.reset)
+
+        print(line)
+
+def print_result(command, result):
+    """
+    Print the result of run_request() for people.
+    """
+    if command == "plan":
+        print_plan(result)
+    elif command == "list":
+        print_rows(result)
+    elif command == "show":
+        for info in result:
+            print_info(info)
+    elif command == "search":
+        print_search_hits(result)
+    else:
+        print_changes(result)
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answers every line of JSON with a line of JSON, see KaliDaemon.
+    """
+    def handle(self):
+        creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        uid = struct.unpack("3i", creds)[1]
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+
+                if not isinstance(request, dict):
+                    raise ValueError()
+            except ValueError:
+                response = {"error": "Invalid request"}
+            else:
+                response = self.server.dispatch(request, uid)
+
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+class KaliDaemon(socketserver.ThreadingUnixStreamServer):
+    """
+    Serves the requests of run_request() over a Unix socket
+    while the global APTManager keeps the package cache loaded.
+
+    Requests that install or remove packages are only accepted
+    from root. They and everything else that marks packages run
+    as jobs, one after the other, while the other requests are
+    answered from the state before the job started.
+    The package lists are refreshed every 'refresh_interval' seconds.
+    """
+    daemon_threads = True
+    default_socket = "/run/katoolin3.sock"
+    # Requests that change the system:
+    changing = ("apply",)
+    # Requests that need the cache to themselves:
+    exclusive = ("apply", "plan")
+
+    def __init__(self, path, refresh_interval):
+        if DaemonClient(path).running():
+            raise OSError("A daemon is already listening on " + path)
+
+        try:
+            # Left behind by a daemon that was killed
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+        super().__init__(path, DaemonRequestHandler)
+        # Everyone may ask, dispatch() decides who may change things
+        os.chmod(path, 0o666)
+        self._path = path
+        self._lock = threading.Lock()
+        self._refresh_interval = refresh_interval
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def dispatch(self, request, uid):
+        command = request.get("command")
+
+        if command in self.changing and uid != 0:
+            return {"error": "Only root can install or remove packages"}
+
+        if command in self.exclusive:
+            job = JOBS.submit(command, self._run, request)
+            job.done.wait()
+
+            # _run() only lets unexpected errors through
+            if job.result is None:
+                return {"error": job.error or "Nothing to do"}
+
+            return job.result
+
+        with self._lock:
+            return self._run(request)
+
+    def _run(self, request):
+        try:
+            result, ok = run_request(request)
+        except VisibleError as v:
+            return {"error": str(v.__cause__)}
+        except (KeyError, TypeError, ValueError):
+            return {"error": "Invalid request"}
+        except StepBack:
+            return {"error": "Nothing to do"}
+        except Exception as e:
+            # E.g. a lock or download failure in commit. The client
+            # must get an answer and the worker has to keep going.
+            return {"error": "{}: {}".format(type(e).__name__, e)}
+
+        return {"ok": ok, "result": result}
+
+    def _refresh(self):
+        while True:
+            time.sleep(self._refresh_interval)
+            job = JOBS.submit("update", APT.update)
+            job.done.wait()
+
+            if job.state == "failed":
+                print(Terminal.red + job.error + Terminal.reset)
+
+    def server_close(self):
+        super().server_close()
+
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+class DaemonClient:
+    """
+    Sends requests made by command_request() to a KaliDaemon.
+    """
+    def __init__(self, path):
+        self._path = path
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            sock.connect(self._path)
+        except OSError:
+            sock.close()
+            raise
+
+        return sock
+
+    def running(self):
+        try:
+            self._connect().close()
+        except OSError:
+            return False
+
+        return True
+
+    def request(self, request):
+        """
+        Return (result, whether it succeeded) like run_request().
+        """
+        try:
+            with self._connect() as sock:
+                sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+
+                with sock.makefile("rb") as file:
+                    response = json.loads(file.readline())
+        except (OSError, ValueError) as e:
+            raise VisibleError() from e
+
+        if "error" in response:
+            raise VisibleError() from APTException(response["error"])
+
+        return response["result"], response["ok"]
+
+def shares_sources(args):
+    """
+    Return whether katoolin3d is running. It owns the sources file
+    and the Kali lists then, so they mustn't be replaced or removed.
+    """
+    if not DaemonClient(args.socket).running():
+        return False
+
+    if args.bundle is not None or args.mirror != APTManager.mirror:
+        raise VisibleError() from APTException("katoolin3d is running with its own sources, stop it to use --import or --mirror")
+
+    return True
+
 def handle_old_katoolin(force=False):
     """
     Detect the old katoolin installation and ask the user
@@ -1305,19 +4768,389 @@ katoolin3 is still running!
 def print_heading(str):
     print(f'{Terminal.green}{str}{Terminal.white}')
 
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="always run a full 'apt-get update' on startup"
+    )
+    parser.add_argument(
+        "--ttl",
+        type=int,
+        default=IndexFreshness.default_ttl,
+        metavar="SECONDS",
+        help="reuse the Kali indexes if they are younger than this (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=0,
+        metavar="N",
+        help="let 'Install All' install N packages per transaction and download "
+             "the next batch while the current one is installed"
+    )
+    parser.add_argument(
+        "--prefetch-budget",
+        type=int,
+        default=1024,
+        metavar="MB",
+        help="disk space for archives downloaded ahead of time (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--export",
+        metavar="DIR",
+        help="download the selected tools and all their dependencies into DIR and exit"
+    )
+    parser.add_argument(
+        "--select",
+        nargs="+",
+        default=[],
+        metavar="NAME",
+        help="categories or packages for --export (default: everything)"
+    )
+    parser.add_argument(
+        "--import",
+        dest="bundle",
+        metavar="DIR",
+        help="install from a directory created with --export instead of the Kali mirror"
+    )
+    parser.add_argument(
+        "--mirror",
+        default=APTManager.mirror,
+        metavar="URL",
+        help="the Kali mirror to use (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--proxy",
+        metavar="[HOST:]PORT",
+        help="run a caching proxy for the Kali mirror instead of the menu"
+    )
+    parser.add_argument(
+        "--proxy-store",
+        default=KaliProxy.default_store,
+        metavar="DIR",
+        help="where the proxy keeps its files (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--proxy-size",
+        type=int,
+        default=10240,
+        metavar="MB",
+        help="the maximum size of the proxy store (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--lean",
+        action="store_true",
+        help="use a leaner package cache that needs less memory"
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="write a trace of where the time goes to FILE (Chrome trace format)"
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="write metrics about this run to FILE for the node_exporter textfile collector"
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="log everything katoolin3 asks the package cache to FILE so that the session can be replayed"
+    )
+    parser.add_argument(
+        "--full-update",
+        action="store_false",
+        dest="scoped",
+        help="refresh all configured sources instead of only the Kali repository"
+    )
+    parser.add_argument(
+        "--lock-timeout",
+        type=int,
+        default=600,
+        metavar="SECONDS",
+        help="how long to wait for other package managers to finish (default: %(default)s)"
+    )
+    # Used by katoolin3 itself to refresh the lists after it exited:
+    parser.add_argument("--deferred-update", action="store_true", help=argparse.SUPPRESS)
+
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep the package lists loaded and serve the commands below on a socket "
+             "(the default when started as katoolin3d)"
+    )
+    parser.add_argument(
+        "--socket",
+        default=KaliDaemon.default_socket,
+        metavar="PATH",
+        help="the socket of the daemon (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="don't hand commands to a running daemon"
+    )
+
+    # Options shared by all subcommands:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--json", action="store_true", help="print the result as JSON")
+    targets = argparse.ArgumentParser(add_help=False, parents=[common])
+    targets.add_argument(
+        "--manifest",
+        metavar="FILE",
+        help='a JSON file like {"install": [NAME, ...], "remove": [NAME, ...]}'
+    )
+
+    commands = parser.add_subparsers(
+        dest="command",
+        metavar="COMMAND",
+        title="commands",
+        description="run without the menu (default: start the menu)"
+    )
+    commands.add_parser(
+        "install",
+        parents=[targets],
+        help="install tools or categories and apply a manifest"
+    ).add_argument("names", nargs="*", metavar="NAME")
+    commands.add_parser(
+        "remove",
+        parents=[targets],
+        help="remove tools or categories and apply a manifest"
+    ).add_argument("names", nargs="*", metavar="NAME")
+    commands.add_parser(
+        "plan",
+        parents=[targets],
+        help="show what install would do"
+    ).add_argument("names", nargs="*", metavar="NAME")
+    converge = commands.add_parser(
+        "converge",
+        parents=[common],
+        help="install and remove only what differs from a manifest, "
+             "without updating or loading the package lists if nothing does"
+    )
+    converge.add_argument("--manifest", required=True, metavar="FILE", help="the desired state")
+    converge.add_argument("names", nargs="*", metavar="NAME", help="more tools or categories to install")
+    commands.add_parser(
+        "list",
+        parents=[common],
+        help="list all tools or those in the given categories"
+    ).add_argument("names", nargs="*", metavar="NAME")
+    commands.add_parser(
+        "show",
+        parents=[common],
+        help="show information about packages"
+    ).add_argument("names", nargs="+", metavar="NAME")
+    commands.add_parser(
+        "search",
+        parents=[common],
+        help="search the repository"
+    ).add_argument("names", nargs="+", metavar="WORD")
+
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
+    TRACER.enabled = bool(args.profile)
+    METRICS.set("katoolin3_tools", len(REGISTRY.names))
+    METRICS.set("katoolin3_last_run_success", 1)
+    recorder = None
+
     try:
+        if args.deferred_update:
+            DeferredUpdate(AptLocks(args.lock_timeout)).run()
+            exit(0)
+
+        if args.proxy:
+            host, _, port = args.proxy.rpartition(":")
+
+            try:
+                proxy = KaliProxy(
+                    (host, int(port)),
+                    ProxyStore(args.proxy_store, args.proxy_size << 20),
+                    args.mirror
+                )
+            except (OSError, ValueError) as e:
+                raise VisibleError() from e
+
+            print("Serving {} on port {}...".format(args.mirror, port))
+            proxy.serve_forever()
+
+        if args.export:
+            with APTManager(
+                refresh=args.refresh,
+                ttl=args.ttl,
+                scoped=args.scoped,
+                mirror=args.mirror,
+                backend=LeanCache if args.lean else apt.Cache,
+                lock_timeout=args.lock_timeout,
+                shared=shares_sources(args)
+            ) as APT:
+                try:
+                    APT.export_bundle(
+                        resolve_selection(args.select) if args.select else all_packages(),
+                        args.export
+                    )
+                except StepBack as s:
+                    print(s)
+
+            exit(0)
+
+        backend = LeanCache if args.lean else apt.Cache
+
+        if args.daemon or os.path.basename(sys.argv[0]) == "katoolin3d":
+            # Clean up like on CTRL+C when systemd stops us
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+            # Checked before the sources file is written, KaliDaemon()
+            # would fail only after the lists were set up
+            if DaemonClient(args.socket).running():
+                raise VisibleError() from APTException("A daemon is already listening on " + args.socket)
+
+            with APTManager(
+                refresh=args.refresh,
+                ttl=args.ttl,
+                scoped=args.scoped,
+                batch_size=args.batch_size,
+                prefetch_budget=args.prefetch_budget << 20,
+                bundle=args.bundle,
+                mirror=args.mirror,
+                backend=backend,
+                lock_timeout=args.lock_timeout
+            ) as APT:
+                try:
+                    daemon = KaliDaemon(args.socket, args.ttl)
+                except OSError as e:
+                    raise VisibleError() from e
+
+                print("Listening on {}...".format(args.socket))
+
+                try:
+                    daemon.serve_forever()
+                finally:
+                    daemon.server_close()
+                    JOBS.wait()
+
+        if args.command:
+            if args.command == "converge":
+                install, remove, unchanged, missing = converge_targets(args)
+                request = {"command": "apply", "install": install, "remove": remove}
+            else:
+                request = command_request(args)
+
+            client = DaemonClient(args.socket)
+
+            if args.command == "converge" and not install and not remove:
+                # The fast path, nothing to update or load
+                result, ok = {"installed": [], "removed": [], "failed": [], "missing": [], "unchanged": []}, True
+            elif not args.local and client.running():
+                if args.record:
+                    # The daemon has its own cache
+                    raise VisibleError() from APTException("katoolin3d can't be recorded, add --local to --record")
+
+                result, ok = client.request(request)
+            else:
+                # Loading the lists writes the sources file
+                if os.geteuid() != 0:
+                    raise VisibleError() from APTException("This needs root unless katoolin3d is running, try sudo")
+
+                if args.record:
+                    try:
+                        backend = recorder = SessionRecorder(args.record, backend)
+                    except OSError as e:
+                        raise VisibleError() from e
+
+                # Keep stdout clean for the JSON
+                with StdoutToStderr() if args.json else contextlib.nullcontext():
+                    with APTManager(
+                        refresh=args.refresh,
+                        ttl=args.ttl,
+                        scoped=args.scoped,
+                        batch_size=args.batch_size,
+                        prefetch_budget=args.prefetch_budget << 20,
+                        bundle=args.bundle,
+                        mirror=args.mirror,
+                        backend=backend,
+                        lock_timeout=args.lock_timeout,
+                        shared=shares_sources(args)
+                    ) as APT:
+                        if args.record:
+                            APT = RecordedManager(APT, backend)
+
+                        result, ok = run_request(request)
+
+            if args.command == "converge":
+                result["unchanged"] = unchanged + result["unchanged"]
+                result["missing"] = missing + result["missing"]
+                ok = ok and not missing
+
+            if args.json:
+                json.dump(result, sys.stdout, indent=4)
+                print()
+            else:
+                print_result(args.command, result)
+
+            exit(0 if ok else 1)
+
+        if args.record:
+            try:
+                backend = recorder = SessionRecorder(args.record, backend)
+            except OSError as e:
+                raise VisibleError() from e
+
         print_logo()
         handle_old_katoolin()
-        with APTManager() as APT: # this will be used globally
+        with APTManager(
+            refresh=args.refresh,
+            ttl=args.ttl,
+            scoped=args.scoped,
+            background=True,
+            batch_size=args.batch_size,
+            prefetch_budget=args.prefetch_budget << 20,
+            bundle=args.bundle,
+            mirror=args.mirror,
+            backend=backend,
+            lock_timeout=args.lock_timeout,
+            shared=shares_sources(args)
+        ) as APT: # this will be used globally
+            if args.record:
+                APT = RecordedManager(APT, backend)
+
             print()
             print_disclaimer()
-            main()
+
+            try:
+                main()
+            finally:
+                # The jobs need the cache until they are done
+                JOBS.wait()
     except (KeyboardInterrupt, StepBack):
         print()
     except VisibleError as v:
         print(v)
+        METRICS.set("katoolin3_last_run_success", 0)
         exit(1)
+    except BaseException as e:
+        if not (isinstance(e, SystemExit) and e.code in (0, None)):
+            METRICS.set("katoolin3_last_run_success", 0)
+
+        raise
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+        if args.profile:
+            try:
+                TRACER.save(args.profile)
+            except OSError as e:
+                print("Could not write the trace: " + str(e))
+
+        if args.metrics:
+            try:
+                METRICS.write(args.metrics)
+            except OSError as e:
+                print("Could not write the metrics: " + str(e))
 
     print("Goodbye")
     exit(0)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+benchmark.py: Time the expensive parts of katoolin3 against
+              a synthetic Kali repository.
+
+The repository contains all packages from katoolin3s package list
+plus as many made up packages as requested. APT is pointed at it
+through a temporary root directory so this needs neither network
+access nor root privileges.
+
+Invoke with: PYTHONPATH=.. ./benchmark.py [--packages N] [--output FILE]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import apt
+import apt_pkg
+
+import katoolin3
+
+# Words for the descriptions so that searching has something to do
+WORDS = (
+    "sql injection wireless password cracker scanner network web proxy fuzzer "
+    "forensics exploit framework bluetooth reverse engineering debugger sniffer "
+    "dns brute force vulnerability analysis hash recovery tunnel library python "
+    "perl ruby java daemon utility console graphical database memory disk image"
+).split()
+
+QUERIES = ["sql injection", "wireless", "password crack", "forensic", "nmap", "reverse engineering"]
+
+def description(rng):
+    summary = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 7)))
+    body = " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 30)))
+    return "{}\n {}".format(summary, body)
+
+def stanza(name, rng, libs, installed=False):
+    lines = [
+        "Package: " + name,
+        "Version: 1.0-{}".format(rng.randint(1, 9)),
+        "Architecture: all",
+        "Maintainer: Benchmark <benchmark@example.org>",
+        "Installed-Size: {}".format(rng.randint(10, 10000))
+    ]
+
+    if installed:
+        lines.insert(1, "Status: install ok installed")
+    else:
+        lines += [
+            "Filename: pool/{}.deb".format(name),
+            "Size: {}".format(rng.randint(1000, 10000000)),
+            "SHA256: " + "0" * 64,
+            "Section: misc"
+        ]
+
+    if libs:
+        deps = rng.sample(libs, min(len(libs), rng.randint(0, 4)))
+
+        if deps:
+            lines.append("Depends: " + ", ".join(deps))
+
+    lines.append("Description: " + description(rng))
+    return "\n".join(lines) + "\n\n"
+
+def build_root(path, num_packages, seed):
+    """
+    Create a repository with at least 'num_packages' packages and
+    an APT root directory below 'path' that uses it. Returns the root.
+    """
+    rng = random.Random(seed)
+    repo = os.path.join(path, "repo")
+    root = os.path.join(path, "root")
+    tools = sorted(katoolin3.REGISTRY.names)
+    libs = []
+
+    for d in ("etc/apt/sources.list.d", "etc/apt/preferences.d", "var/lib/apt/lists/partial",
+              "var/lib/dpkg", "var/cache/apt/archives/partial"):
+        os.makedirs(os.path.join(root, d))
+
+    os.makedirs(repo)
+
+    with open(os.path.join(repo, "Packages"), "w") as packages, \
+         open(os.path.join(root, "var/lib/dpkg/status"), "w") as status:
+        # Libraries only depend on earlier libraries so there are no cycles
+        for i in range(max(0, num_packages - len(tools))):
+            name = "lib-bench{}".format(i)
+            packages.write(stanza(name, rng, libs[-200:]))
+
+            # Some of them are already installed
+            if rng.random() < 0.1:
+                status.write(stanza(name, rng, [], installed=True))
+
+            libs.append(name)
+
+        for name in tools:
+            packages.write(stanza(name, rng, libs))
+
+    with open(os.path.join(root, "etc/apt/sources.list"), "w") as file:
+        file.write("deb [trusted=yes] file:{} ./\n".format(repo))
+
+    # Skip 'apt-get update' by putting the index where it would end up
+    lists = os.path.join(root, "var/lib/apt/lists")
+    shutil.copy(
+        os.path.join(repo, "Packages"),
+        os.path.join(lists, apt_pkg.uri_to_filename("file:{}/./Packages".format(repo)))
+    )
+
+    return root
+
+def measure(func, repeat, setup=None):
+    """
+    Run 'func' 'repeat' times and return statistics in milliseconds.
+    'setup' is run before every run and not measured.
+    """
+    runs = []
+
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+
+        start = time.perf_counter()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+
+        runs.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "min": min(runs),
+        "median": statistics.median(runs),
+        "mean": statistics.mean(runs),
+        "runs": repeat
+    }
+
+def render_menus(apt_mgr):
+    """
+    Build and render the menus the way view_categories()
+    and view_packages() do.
+    """
+    states = apt_mgr.package_states()
+    lines = 0
+
+    sel = katoolin3.Selection("Select a Category")
+
+    for cat in katoolin3.PACKAGES:
+        sel.add_choice(cat, cat)
+
+    lines += len(list(sel))
+
+    for cat in katoolin3.PACKAGES:
+        sel = katoolin3.Selection("Select a Package")
+
+        for pkg in katoolin3.REGISTRY.category(cat):
+            if states[pkg].installed:
+                sel.add_choice(katoolin3.REGISTRY[pkg].nice_name, pkg, katoolin3.Terminal.black)
+            else:
+                sel.add_choice(katoolin3.REGISTRY[pkg].nice_name, pkg)
+
+        lines += len(list(sel))
+
+    # The longest list there is
+    sel = katoolin3.Selection("Not installed")
+
+    for pkg in katoolin3.REGISTRY.sorted_names:
+        sel.add_choice(pkg, pkg)
+
+    lines += len(list(sel))
+    lines += len(list(sel._render(sel._filtered("sql"))))
+    return lines
+
+def run(root, state_dir, repeat):
+    # Keep all state katoolin3 writes inside the temporary directory
+    katoolin3.IndexFreshness.state_dir = state_dir
+    katoolin3.PackageSnapshot.path = os.path.join(state_dir, "snapshot.json")
+    katoolin3.SearchIndex.path = os.path.join(state_dir, "search.idx")
+
+    apt_mgr = katoolin3.APTManager(silent=True, backend=lambda: apt.Cache(rootdir=root))
+    apt_mgr._reload()
+    tools = sorted(katoolin3.REGISTRY.names)
+    key = apt_mgr._search_key()
+
+    def mark_all():
+        apt_mgr._make_current()
+
+        if not apt_mgr._try_marks(tools):
+            raise RuntimeError("The synthetic repository is broken")
+
+        apt_mgr._cache.clear()
+
+    def transaction():
+        # What a transaction leaves behind, flush() looks them up again
+        apt_mgr._touched.update(tools)
+
+    def show():
+        for pkg in tools[:20]:
+            apt_mgr.show(pkg)
+
+    index = katoolin3.SearchIndex.build(key, apt_mgr._cache)
+    index.save()
+
+    def search():
+        for query in QUERIES:
+            index.query(query)
+
+    results = {
+        "cache_open": measure(apt_mgr._reload, repeat),
+        "flush_after_transaction": measure(apt_mgr.flush, repeat, setup=transaction),
+        "mark_all_tools": measure(mark_all, repeat),
+        "search_index_build": measure(lambda: katoolin3.SearchIndex.build(key, apt_mgr._cache), repeat),
+        "search_index_load": measure(lambda: katoolin3.SearchIndex.load(key), repeat),
+        "search_query": measure(search, repeat),
+        "show": measure(show, repeat),
+        "package_states": measure(apt_mgr.package_states, repeat),
+        "menu_render": measure(lambda: render_menus(apt_mgr), repeat)
+    }
+
+    return len(apt_mgr._cache), results
+
+def compare(baseline, current):
+    """
+    Print how the medians changed relative to 'baseline'.
+    This goes to stderr so that stdout stays valid JSON.
+    """
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+
+        if old is None:
+            print("{:<20} {:>10.2f} ms        new".format(name, result["median"]), file=sys.stderr)
+        else:
+            print("{:<20} {:>10.2f} ms {:>+8.1f}%".format(
+                name,
+                result["median"],
+                (result["median"] / old["median"] - 1) * 100
+            ), file=sys.stderr)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark katoolin3 against a synthetic repository")
+    parser.add_argument(
+        "--packages",
+        type=int,
+        default=5000,
+        metavar="N",
+        help="number of packages in the repository (default: 5000)"
+    )
+    parser.add_argument("--repeat", type=int, default=5, metavar="N", help="runs per benchmark (default: 5)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for generating the repository")
+    parser.add_argument("--output", metavar="FILE", help="write the results to FILE instead of stdout")
+    parser.add_argument("--baseline", metavar="FILE", help="compare the results to an earlier output")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    tmp = tempfile.mkdtemp(prefix="katoolin3-bench-")
+
+    try:
+        root = build_root(tmp, args.packages, args.seed)
+        state_dir = os.path.join(tmp, "state")
+        os.makedirs(state_dir)
+        num, results = run(root, state_dir, args.repeat)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {
+        "packages": num,
+        "tools": len(katoolin3.REGISTRY.names),
+        "seed": args.seed,
+        "python": platform.python_version(),
+        "apt": apt_pkg.VERSION,
+        "results": results
+    }
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=4, sort_keys=True)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(json.load(file), report)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+replay.py: Replay a session recorded with 'katoolin3 --record FILE'
+           and time the Python side of every call the menus made.
+
+Nothing is downloaded or installed and the package database of
+this machine is not used, so this needs no root privileges.
+
+Invoke with: PYTHONPATH=.. ./replay.py FILE [--repeat N] [--output FILE]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import katoolin3
+
+def replay(path, batch_size):
+    """
+    Replay the session in 'path' once and return a list
+    with the result of every call.
+    """
+    session = katoolin3.SessionReplayer(path)
+    apt_mgr = katoolin3.APTManager(silent=True, batch_size=batch_size, backend=session)
+    ret = []
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        apt_mgr._load()
+
+    for call in session.calls:
+        method = getattr(apt_mgr, call["name"])
+        error = None
+        start = time.perf_counter()
+
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                method(*call["args"], **call["kwargs"])
+        except katoolin3.ReplayMismatch as e:
+            error = "diverged: " + str(e)
+        except Exception as e:
+            error = type(e).__name__
+
+        ret.append({
+            "name": call["name"],
+            "recorded_ms": call["ms"],
+            "replayed_ms": (time.perf_counter() - start) * 1000,
+            "diverged": error is not None and error.startswith("diverged"),
+            "error": error
+        })
+
+    return ret
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay a recorded katoolin3 session")
+    parser.add_argument("log", help="the file passed to 'katoolin3 --record'")
+    parser.add_argument("--repeat", type=int, default=5, metavar="N", help="number of replays (default: 5)")
+    parser.add_argument("--batch-size", type=int, default=0, metavar="N", help="the --batch-size of the recorded session")
+    parser.add_argument("--output", metavar="FILE", help="write the results to FILE instead of stdout")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    tmp = tempfile.mkdtemp(prefix="katoolin3-replay-")
+
+    # Keep all state katoolin3 writes inside the temporary directory
+    katoolin3.IndexFreshness.state_dir = tmp
+    katoolin3.PackageSnapshot.path = os.path.join(tmp, "snapshot.json")
+    katoolin3.SearchIndex.path = os.path.join(tmp, "search.idx")
+
+    try:
+        runs = [replay(args.log, args.batch_size) for _ in range(args.repeat)]
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    calls = []
+
+    for i, first in enumerate(runs[0]):
+        times = [run[i]["replayed_ms"] for run in runs]
+        calls.append({
+            "name": first["name"],
+            "recorded_ms": first["recorded_ms"],
+            "min_ms": min(times),
+            "median_ms": statistics.median(times),
+            "error": first["error"]
+        })
+
+    report = {
+        "log": os.path.basename(args.log),
+        "repeat": args.repeat,
+        "calls": calls,
+        "total_median_ms": sum(call["median_ms"] for call in calls),
+        "diverged": sum(1 for call in runs[0] if call["diverged"])
+    }
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=4, sort_keys=True)
+        print()
+
+    if report["diverged"]:
+        print("{} calls took a different path than in the recording".format(report["diverged"]), file=sys.stderr)
+        exit(1)
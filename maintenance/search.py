@@ -7,17 +7,15 @@ search.py: Search the Kali repostiories.
 Invoke with: sudo PYTHONPATH=.. ./search.py
 """
 
-import os
-import shlex
 import katoolin3
 
 if __name__ == "__main__":
     with katoolin3.APTManager(silent=True) as apt_mgr:
         while True:
-            search = shlex.quote(input("Search: "))
+            search = input("Search: ").strip()
 
             if search:
                 if apt_mgr.has_package(search):
-                    os.system(f"apt show {search}")
+                    apt_mgr.show(search)
                 else:
-                    os.system(f"apt search {search}")
+                    apt_mgr.search(search)
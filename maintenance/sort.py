@@ -1,39 +1,27 @@
 #!/usr/bin/env python3
 
 """
-sort.py: Takes katoolin3s package list, sorts it and outputs
-         it so that it can be directly copy-and-pasted into
-         the source file.
+sort.py: Takes katoolin3s package list and sorts it in place.
 
 Invoke with: PYTHONPATH=.. ./sort.py
 """
 
-from katoolin3 import PACKAGES
+import json
 
-outfile = "sorted.lst"
+from katoolin3 import packages_file
 
-def sort_out():
-    # Not very efficient but who cares
-    yield "PACKAGES = {\n"
-    for i, cat in enumerate(sorted(PACKAGES.keys())):
-        yield f"    \"{cat}\" : [\n"
+def sort_packages(packages):
+    return {
+        cat: sorted(packages[cat])
+        for cat in sorted(packages)
+    }
 
-        for j, pkg in enumerate(sorted(PACKAGES[cat])):
-            yield f"        \"{pkg}\""
+if __name__ == "__main__":
+    path = packages_file()
 
-            if j < len(PACKAGES[cat]) - 1:
-                yield ",\n"
-            else:
-                yield "\n"
+    with open(path, "r") as file:
+        packages = json.load(file)
 
-        yield "    ]"
-
-        if i < len(PACKAGES) - 1:
-            yield ",\n"
-        else:
-            yield "\n"
-    yield "}\n"
-
-with open(outfile, "w") as file:
-    for line in sort_out():
-        file.write(line)
+    with open(path, "w") as file:
+        json.dump(sort_packages(packages), file, indent=4)
+        file.write("\n")
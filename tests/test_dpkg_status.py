@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for reading installed packages straight from
+a sample dpkg status file (read_dpkg_status).
+
+Invoke with: python3 -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import katoolin3
+
+STATUS = """\
+Package: nmap
+Status: install ok installed
+Priority: optional
+Version: 7.94+git20230807.3be01efb1+dfsg-3
+
+Package: sqlmap
+Status: deinstall ok config-files
+Version: 1.7.2-1
+
+Package: libfoo1
+Status: install ok installed
+Architecture: i386
+Version: 1.0-1
+
+Package: wireshark
+Status: install ok half-configured
+Version: 4.0.6-1
+
+Package: libfoo1
+Status: deinstall ok not-installed
+Architecture: amd64
+
+Package: nmap-common
+Status: install ok installed
+Version: 7.94-3
+Description: not Package: nmap
+"""
+
+class ReadDpkgStatusTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="katoolin3-test-")
+        self.path = os.path.join(self.tmp, "status")
+
+        with open(self.path, "w") as file:
+            file.write(STATUS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def read(self, names):
+        return katoolin3.read_dpkg_status(names, self.path)
+
+    def test_installed(self):
+        self.assertEqual(
+            self.read(["nmap", "nmap-common"]),
+            {
+                "nmap": katoolin3.DpkgStatus(True, "7.94+git20230807.3be01efb1+dfsg-3"),
+                "nmap-common": katoolin3.DpkgStatus(True, "7.94-3")
+            }
+        )
+
+    def test_not_installed(self):
+        self.assertEqual(
+            self.read(["sqlmap", "wireshark", "unknown"]),
+            {name: katoolin3.DpkgStatus(False, None) for name in ("sqlmap", "wireshark", "unknown")}
+        )
+
+    def test_any_architecture_counts(self):
+        self.assertEqual(self.read(["libfoo1"]), {"libfoo1": katoolin3.DpkgStatus(True, "1.0-1")})
+
+    def test_last_stanza_without_blank_line(self):
+        with open(self.path, "w") as file:
+            file.write("Package: nmap\nStatus: install ok installed\nVersion: 7.94-3")
+
+        self.assertEqual(self.read(["nmap"]), {"nmap": katoolin3.DpkgStatus(True, "7.94-3")})
+
+    def test_empty_file(self):
+        open(self.path, "w").close()
+        self.assertEqual(self.read(["nmap"]), {"nmap": katoolin3.DpkgStatus(False, None)})
+
+    def test_missing_file(self):
+        os.remove(self.path)
+
+        with self.assertRaises(OSError):
+            self.read(["nmap"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for waiting on the locks of other package managers
+(AptLocks) and for merging deferred updates (DeferredUpdate).
+None of them need apt or root.
+
+Invoke with: python3 -m unittest discover tests
+"""
+
+import fcntl
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import katoolin3
+
+# Holds a lock on argv[2] with fcntl.<argv[1]> until stdin is closed
+HOLDER = """
+import fcntl, sys
+file = open(sys.argv[2], "w")
+getattr(fcntl, sys.argv[1])(file, fcntl.LOCK_EX)
+print("locked", flush=True)
+sys.stdin.read()
+"""
+
+class LockHolder:
+    """
+    A child process that holds the lock 'path' while in use,
+    with lockf() like dpkg and APT or with flock().
+    """
+    def __init__(self, path, func="lockf"):
+        self._path = path
+        self._func = func
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", HOLDER, self._func, self._path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+        assert self.process.stdout.readline() == b"locked\n"
+        return self.process
+
+    def __exit__(self, *nil):
+        self.process.stdin.close()
+        self.process.wait()
+        self.process.stdout.close()
+
+class AptLocksTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="katoolin3-test-")
+        self.path = os.path.join(self.tmp, "lock")
+        open(self.path, "w").close()
+        self.locks = katoolin3.AptLocks(0.3, max_delay=0.1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_free(self):
+        self.assertIsNone(katoolin3.AptLocks.holder(self.path))
+        self.assertIsNone(katoolin3.AptLocks.holder(os.path.join(self.tmp, "missing")))
+        self.assertEqual(self.locks.holders([self.path]), {})
+
+    def test_holder(self):
+        with LockHolder(self.path) as child:
+            name = katoolin3.AptLocks.process_name(child.pid)
+
+            self.assertEqual(katoolin3.AptLocks.holder(self.path), child.pid)
+            self.assertTrue(name.startswith("python"), name)
+            self.assertEqual(self.locks.holders([self.path]), {self.path: "{} ({})".format(name, child.pid)})
+
+        self.assertIsNone(katoolin3.AptLocks.holder(self.path))
+
+    def test_own_locks_dont_count(self):
+        with open(self.path, "w") as file:
+            fcntl.lockf(file, fcntl.LOCK_EX)
+            self.assertIsNone(katoolin3.AptLocks.holder(self.path))
+
+    def test_wait_times_out(self):
+        with LockHolder(self.path):
+            with self.assertRaises(katoolin3.VisibleError) as cm:
+                self.locks.wait([self.path], quiet=True)
+
+        self.assertIn(self.path, str(cm.exception))
+
+    def test_wait_returns_when_free(self):
+        self.locks.wait([self.path])
+
+class DeferredUpdateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="katoolin3-test-")
+        patches = [
+            mock.patch.object(katoolin3.IndexFreshness, "state_dir", self.tmp),
+            mock.patch.object(katoolin3.AptLocks, "lists_paths", staticmethod(lambda: [])),
+            mock.patch.object(katoolin3.subprocess, "run")
+        ]
+
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.update = katoolin3.DeferredUpdate(katoolin3.AptLocks(1))
+        self.marker = os.path.join(self.tmp, "update.pending")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def apt_get_calls(self):
+        return [call for call in katoolin3.subprocess.run.call_args_list if call.args[0][0] == "apt-get"]
+
+    def test_nothing_requested(self):
+        self.update.run()
+        self.assertEqual(self.apt_get_calls(), [])
+
+    def test_requests_during_an_update_are_merged(self):
+        # Three more requests come in while the first update runs
+        def apt_get(*nil, **nil2):
+            if len(self.apt_get_calls()) == 1:
+                for _ in range(3):
+                    open(self.marker, "w").close()
+
+        katoolin3.subprocess.run.side_effect = apt_get
+        open(self.marker, "w").close()
+        self.update.run()
+
+        self.assertEqual(len(self.apt_get_calls()), 2)
+        self.assertFalse(os.path.exists(self.marker))
+
+    def test_only_one_process_updates(self):
+        open(self.marker, "w").close()
+
+        # The other process will see the marker
+        with LockHolder(os.path.join(self.tmp, "update.lock"), "flock"):
+            self.update.run()
+
+        self.assertEqual(self.apt_get_calls(), [])
+        self.assertTrue(os.path.exists(self.marker))
+
+    def test_satisfied(self):
+        open(self.marker, "w").close()
+        self.update.satisfied()
+        self.update.satisfied()
+        self.assertFalse(os.path.exists(self.marker))
+
+class DeferredTriggersTest(unittest.TestCase):
+    def setUp(self):
+        for patch in (mock.patch.object(katoolin3.subprocess, "run"), mock.patch.object(katoolin3, "report")):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.locks = mock.Mock()
+
+    def test_waits_for_dpkg(self):
+        with katoolin3.DeferredTriggers(self.locks):
+            pass
+
+        self.locks.wait.assert_called_once()
+        katoolin3.subprocess.run.assert_called_once()
+
+    def test_no_second_wait_after_a_failure(self):
+        with self.assertRaises(katoolin3.VisibleError):
+            with katoolin3.DeferredTriggers(self.locks):
+                raise katoolin3.VisibleError() from katoolin3.APTException("still locked")
+
+        self.locks.wait.assert_not_called()
+        katoolin3.subprocess.run.assert_called_once()
+
+    def test_no_terminal_in_a_job(self):
+        with mock.patch.object(katoolin3.JOBS, "current", return_value=mock.Mock()):
+            with katoolin3.DeferredTriggers(self.locks):
+                pass
+
+        options = katoolin3.subprocess.run.call_args.kwargs
+
+        for stream in ("stdin", "stdout", "stderr"):
+            self.assertEqual(options[stream], katoolin3.subprocess.DEVNULL)
+
+        self.assertEqual(options["env"]["DEBIAN_FRONTEND"], "noninteractive")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for loading the package list (load_packages) with
+a site-local overlay (merge_overlay) and its cache.
+
+Invoke with: python3 -m unittest discover tests
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import katoolin3
+
+class MergeOverlayTest(unittest.TestCase):
+    def test_add(self):
+        packages = {"Sniffing": ["wireshark"]}
+        overlay = {"add": {"Sniffing": ["tcpdump", "wireshark"], "Local": ["our-tool"]}}
+
+        self.assertEqual(
+            katoolin3.merge_overlay(packages, overlay),
+            {"Sniffing": ["wireshark", "tcpdump"], "Local": ["our-tool"]}
+        )
+
+    def test_hide(self):
+        packages = {"Sniffing": ["wireshark", "tcpdump"], "Forensics": ["maltego"]}
+
+        # Categories that end up empty go away
+        self.assertEqual(
+            katoolin3.merge_overlay(packages, {"hide": ["tcpdump", "maltego"]}),
+            {"Sniffing": ["wireshark"]}
+        )
+
+    def test_hide_wins_over_add(self):
+        overlay = {"add": {"Local": ["our-tool"]}, "hide": ["our-tool"]}
+        self.assertEqual(katoolin3.merge_overlay({}, overlay), {})
+
+    def test_empty_overlay(self):
+        packages = {"Sniffing": ["wireshark"]}
+        self.assertEqual(katoolin3.merge_overlay(packages, {}), packages)
+
+class LoadPackagesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="katoolin3-test-")
+        self.list = os.path.join(self.tmp, "packages.json")
+        self.overlay = os.path.join(self.tmp, "overlay.json")
+        self.cache = os.path.join(self.tmp, "cache", "packages.cache")
+        patches = [
+            mock.patch.object(katoolin3, "PACKAGES_FILES", [os.path.join(self.tmp, "missing.json"), self.list]),
+            mock.patch.object(katoolin3, "PACKAGES_OVERLAY", self.overlay),
+            mock.patch.object(katoolin3, "PACKAGES_CACHE", self.cache)
+        ]
+
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.stamp = 10 ** 18
+        self.write(self.list, {"Sniffing": ["wireshark", "tcpdump"]})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def write(self, path, data):
+        with open(path, "w") as file:
+            json.dump(data, file)
+
+        # Not every file system has fine grained times, so
+        # every write gets a second of its own
+        self.stamp += 10 ** 9
+        os.utime(path, ns=(self.stamp, self.stamp))
+
+    def test_first_file_that_exists(self):
+        self.assertEqual(katoolin3.packages_file(), self.list)
+
+    def test_load(self):
+        self.assertEqual(katoolin3.load_packages(), {"Sniffing": ["wireshark", "tcpdump"]})
+        self.assertTrue(os.path.isfile(self.cache))
+
+    def test_overlay(self):
+        self.write(self.overlay, {"hide": ["tcpdump"]})
+        self.assertEqual(katoolin3.load_packages(), {"Sniffing": ["wireshark"]})
+
+    def test_cache_is_used(self):
+        katoolin3.load_packages()
+
+        with mock.patch.object(katoolin3.json, "load") as load:
+            self.assertEqual(katoolin3.load_packages(), {"Sniffing": ["wireshark", "tcpdump"]})
+
+        load.assert_not_called()
+
+    def test_cache_follows_the_files(self):
+        katoolin3.load_packages()
+        self.write(self.list, {"Sniffing": ["wireshark"]})
+        self.assertEqual(katoolin3.load_packages(), {"Sniffing": ["wireshark"]})
+
+        self.write(self.overlay, {"add": {"Local": ["our-tool"]}})
+        self.assertEqual(katoolin3.load_packages(), {"Sniffing": ["wireshark"], "Local": ["our-tool"]})
+
+        os.remove(self.overlay)
+        self.assertEqual(katoolin3.load_packages(), {"Sniffing": ["wireshark"]})
+
+    def test_broken_cache_is_ignored(self):
+        os.makedirs(os.path.dirname(self.cache))
+
+        with open(self.cache, "wb") as file:
+            file.write(b"garbage")
+
+        self.assertEqual(katoolin3.load_packages(), {"Sniffing": ["wireshark", "tcpdump"]})
+
+    def test_broken_overlay_is_ignored(self):
+        with open(self.overlay, "w") as file:
+            file.write("{")
+
+        with mock.patch("builtins.print"):
+            self.assertEqual(katoolin3.load_packages(), {"Sniffing": ["wireshark", "tcpdump"]})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the caching proxy (katoolin3 --proxy) against
+a local HTTP server that stands in for the Kali mirror.
+
+Invoke with: python3 -m unittest discover tests
+"""
+
+import http.client
+import http.server
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import katoolin3
+
+class Mirror(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the files in 'files' of the server and
+    remembers every path that was requested. Paths in
+    'stalled' get no body, paths in 'short' half of it.
+    """
+    def log_message(self, *nil):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        body = self.server.files.get(self.path)
+
+        if body is None:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if self.path in self.server.stalled:
+            time.sleep(1)
+        elif self.path in self.server.short:
+            self.wfile.write(body[:len(body) // 2])
+        else:
+            self.wfile.write(body)
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class ProxyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="katoolin3-test-")
+        self.mirror = serve(http.server.ThreadingHTTPServer(("127.0.0.1", 0), Mirror))
+        self.mirror.files = {}
+        self.mirror.requests = []
+        self.mirror.stalled = set()
+        self.mirror.short = set()
+        self.store_dir = os.path.join(self.tmp, "store")
+        self.proxy = serve(katoolin3.KaliProxy(
+            ("127.0.0.1", 0),
+            katoolin3.ProxyStore(self.store_dir, 1 << 20),
+            "http://127.0.0.1:{}/kali".format(self.mirror.server_address[1])
+        ))
+
+    def tearDown(self):
+        for server in (self.proxy, self.mirror):
+            server.shutdown()
+            server.server_close()
+
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def get(self, path):
+        conn = http.client.HTTPConnection(*self.proxy.server_address, timeout=10)
+
+        try:
+            conn.request("GET", path)
+            r = conn.getresponse()
+            return r.status, r.read()
+        finally:
+            conn.close()
+
+    def objects(self):
+        return [
+            name
+            for _, _, files in os.walk(os.path.join(self.store_dir, "objects"))
+            for name in files
+        ]
+
+    def test_pool_files_are_fetched_once(self):
+        self.mirror.files["/kali/pool/main/n/nmap/nmap.deb"] = b"deb"
+
+        self.assertEqual(self.get("/kali/pool/main/n/nmap/nmap.deb"), (200, b"deb"))
+        self.assertEqual(self.get("/kali/pool/main/n/nmap/nmap.deb"), (200, b"deb"))
+        self.assertEqual(self.mirror.requests, ["/kali/pool/main/n/nmap/nmap.deb"])
+
+    def test_missing_files(self):
+        self.assertEqual(self.get("/kali/pool/nothing.deb")[0], 404)
+        self.assertEqual(self.objects(), [])
+
+    def test_only_the_mirror_is_fetched(self):
+        port = self.mirror.server_address[1]
+
+        for path in (
+            "@127.0.0.1:{}/kali/x".format(port),
+            ".example.org/kali/x",
+            "/other/x",
+            "/kali/../other/x",
+            "/kali/%2e%2e/other/x",
+            "/kalix/x"
+        ):
+            self.assertEqual(self.get(path)[0], 403, path)
+
+        self.assertEqual(self.mirror.requests, [])
+
+    def test_refetched_indexes_replace_their_object(self):
+        path = "/kali/dists/kali-rolling/InRelease"
+        old_max_age = katoolin3.ProxyRequestHandler.index_max_age
+        katoolin3.ProxyRequestHandler.index_max_age = -1
+
+        try:
+            for i in range(5):
+                self.mirror.files[path] = "release {}".format(i).encode()
+                self.assertEqual(self.get(path), (200, self.mirror.files[path]))
+        finally:
+            katoolin3.ProxyRequestHandler.index_max_age = old_max_age
+
+        self.assertEqual(len(self.mirror.requests), 5)
+        self.assertEqual(len(self.objects()), 1)
+
+    def test_shared_objects_are_kept(self):
+        self.mirror.files["/kali/dists/a/Release"] = b"same"
+        self.mirror.files["/kali/dists/b/Release"] = b"same"
+        old_max_age = katoolin3.ProxyRequestHandler.index_max_age
+        katoolin3.ProxyRequestHandler.index_max_age = -1
+
+        try:
+            self.get("/kali/dists/a/Release")
+            self.get("/kali/dists/b/Release")
+            self.mirror.files["/kali/dists/a/Release"] = b"new"
+            self.get("/kali/dists/a/Release")
+        finally:
+            katoolin3.ProxyRequestHandler.index_max_age = old_max_age
+
+        # b still points to the old content
+        self.assertEqual(len(self.objects()), 2)
+
+    def test_stalled_mirror(self):
+        path = "/kali/dists/kali-rolling/InRelease"
+        self.mirror.files[path] = b"release"
+        self.assertEqual(self.get(path), (200, b"release"))
+
+        self.mirror.stalled.add(path)
+        old_max_age = katoolin3.ProxyRequestHandler.index_max_age
+        old_timeout = katoolin3.ProxyRequestHandler.upstream_timeout
+        katoolin3.ProxyRequestHandler.index_max_age = -1
+        katoolin3.ProxyRequestHandler.upstream_timeout = 0.3
+
+        try:
+            # Nothing was sent yet, so the stored copy can still be
+            self.assertEqual(self.get(path), (200, b"release"))
+            self.mirror.files["/kali/pool/new.deb"] = b"deb"
+            self.mirror.stalled.add("/kali/pool/new.deb")
+            self.assertEqual(self.get("/kali/pool/new.deb")[0], 502)
+        finally:
+            katoolin3.ProxyRequestHandler.index_max_age = old_max_age
+            katoolin3.ProxyRequestHandler.upstream_timeout = old_timeout
+
+    def test_short_body_is_not_stored(self):
+        path = "/kali/pool/main/s/sqlmap/sqlmap.deb"
+        self.mirror.files[path] = b"x" * 1000
+        self.mirror.short.add(path)
+
+        # The response ends early instead of getting a second status line
+        with self.assertRaises(http.client.IncompleteRead):
+            self.get(path)
+
+        self.assertEqual(self.objects(), [])
+        self.mirror.short.clear()
+        self.assertEqual(self.get(path), (200, b"x" * 1000))
+        self.assertEqual(len(self.mirror.requests), 2)
+
+if __name__ == "__main__":
+    unittest.main()
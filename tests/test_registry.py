@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the lookup tables built from the package list (PackageRegistry).
+
+Invoke with: python3 -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import katoolin3
+
+PACKAGES = {
+    "Information Gathering": ["nmap", "dnsenum", "nmap"],
+    "Vulnerability Analysis": ["sqlmap", "nmap"],
+    "Wireless Attacks": ["aircrack-ng", "python-wifite"]
+}
+
+class PackageRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = katoolin3.PackageRegistry(PACKAGES)
+
+    def test_names(self):
+        names = ["aircrack-ng", "dnsenum", "nmap", "python-wifite", "sqlmap"]
+
+        self.assertEqual(self.registry.names, frozenset(names))
+        self.assertEqual(self.registry.sorted_names, tuple(names))
+
+    def test_categories_keep_the_list_order(self):
+        self.assertEqual(self.registry.categories("nmap"), ("Information Gathering", "Vulnerability Analysis"))
+        self.assertEqual(self.registry.categories("sqlmap"), ("Vulnerability Analysis",))
+        self.assertEqual(self.registry.categories("unknown"), ())
+
+    def test_category_is_sorted_without_duplicates(self):
+        self.assertEqual(self.registry.category("Information Gathering"), ("dnsenum", "nmap"))
+
+        with self.assertRaises(KeyError):
+            self.registry.category("Unknown")
+
+    def test_records(self):
+        self.assertIn("nmap", self.registry)
+        self.assertNotIn("unknown", self.registry)
+        self.assertEqual(self.registry["aircrack-ng"].nice_name, "aircrack-ng")
+        self.assertEqual(self.registry["python-wifite"].nice_name, "Wifite")
+
+        with self.assertRaises(KeyError):
+            self.registry["unknown"]
+
+    def test_nice_name(self):
+        self.assertEqual(katoolin3.nice_name("Nmap"), "nmap")
+        self.assertEqual(katoolin3.nice_name("python-impacket-scripts"), "Impacket Scripts")
+        self.assertEqual(katoolin3.nice_name("set-ng"), "set-ng")
+
+    def test_global_registry_matches_the_package_list(self):
+        self.assertEqual(
+            katoolin3.REGISTRY.names,
+            frozenset(pkg for pkgs in katoolin3.PACKAGES.values() for pkg in pkgs)
+        )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the search index (SearchIndex) with a few packages
+that stand in for the apt cache.
+
+Invoke with: python3 -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import katoolin3
+
+Package = namedtuple("Package", ["name", "candidate"])
+Version = namedtuple("Version", ["summary", "description"])
+
+CACHE = [
+    Package("sqlmap", Version("automatic SQL injection tool", "Detects and exploits SQL injection flaws.")),
+    Package("sqlninja", Version("SQL server injection and takeover tool", "Exploits SQL injection on Microsoft SQL Server.")),
+    Package("nmap", Version("The Network Mapper", "Scans networks for hosts and services.")),
+    Package("nmapsi4", Version("graphical interface to nmap", "A Qt frontend for nmap.")),
+    Package("virtual-only", None)
+]
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="katoolin3-test-")
+        self.old_path = katoolin3.SearchIndex.path
+        katoolin3.SearchIndex.path = os.path.join(self.tmp, "search.idx")
+        self.index = katoolin3.SearchIndex.build("key", CACHE)
+
+    def tearDown(self):
+        katoolin3.SearchIndex.path = self.old_path
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def names(self, index, text):
+        return [hit.name for hit in index.query(text)]
+
+    def test_tokenize(self):
+        self.assertEqual(katoolin3.SearchIndex.tokenize("Wi-Fi 2.4GHz, WPA2!"), ["wi", "fi", "2", "4ghz", "wpa2"])
+
+    def test_packages_without_candidate_are_skipped(self):
+        self.assertEqual(self.names(self.index, "virtual"), [])
+
+    def test_name_ranks_first(self):
+        self.assertEqual(self.names(self.index, "nmap"), ["nmap", "nmapsi4"])
+
+    def test_all_words_have_to_match(self):
+        self.assertEqual(sorted(self.names(self.index, "sql injection")), ["sqlmap", "sqlninja"])
+        self.assertEqual(self.names(self.index, "sql network"), [])
+
+    def test_prefixes(self):
+        self.assertEqual(sorted(self.names(self.index, "inject")), ["sqlmap", "sqlninja"])
+        # Too short for a prefix
+        self.assertEqual(self.names(self.index, "nm"), [])
+
+    def test_hits(self):
+        hit = self.index.query("mapper")[0]
+
+        self.assertEqual((hit.name, hit.summary), ("nmap", "The Network Mapper"))
+        self.assertGreater(hit.score, 0)
+
+    def test_limit(self):
+        self.assertEqual(len(self.index.query("tool", limit=1)), 1)
+
+    def test_save_and_load(self):
+        self.index.save()
+        loaded = katoolin3.SearchIndex.load("key")
+
+        for text in ("nmap", "sql injection", "inject", "frontend"):
+            self.assertEqual(loaded.query(text), self.index.query(text), text)
+
+    def test_outdated_or_broken_files_are_ignored(self):
+        self.assertIsNone(katoolin3.SearchIndex.load("key"))
+        self.index.save()
+        self.assertIsNone(katoolin3.SearchIndex.load("other key"))
+
+        with open(katoolin3.SearchIndex.path, "wb") as file:
+            file.write(b"garbage")
+
+        self.assertIsNone(katoolin3.SearchIndex.load("key"))
+
+if __name__ == "__main__":
+    unittest.main()
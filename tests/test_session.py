@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for recording a session (katoolin3 --record) and replaying
+it with maintenance/replay.py against the synthetic repository of
+maintenance/benchmark.py. This needs python3-apt but no root.
+
+Invoke with: python3 -m unittest discover tests
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import apt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "maintenance"))
+
+import katoolin3
+import benchmark
+import replay
+
+class SessionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp(prefix="katoolin3-test-")
+        cls.root = benchmark.build_root(cls.tmp, 1000, 0)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def setUp(self):
+        self.old_paths = (katoolin3.IndexFreshness.state_dir, katoolin3.PackageSnapshot.path, katoolin3.SearchIndex.path)
+        self.new_state_dir()
+
+    def new_state_dir(self):
+        state_dir = tempfile.mkdtemp(dir=self.tmp)
+        katoolin3.IndexFreshness.state_dir = state_dir
+        katoolin3.PackageSnapshot.path = os.path.join(state_dir, "snapshot.json")
+        katoolin3.SearchIndex.path = os.path.join(state_dir, "search.idx")
+
+    def tearDown(self):
+        katoolin3.IndexFreshness.state_dir, katoolin3.PackageSnapshot.path, katoolin3.SearchIndex.path = self.old_paths
+
+    def backend(self):
+        return apt.Cache(rootdir=self.root)
+
+    def record(self, log):
+        recorder = katoolin3.SessionRecorder(log, self.backend)
+        manager = katoolin3.APTManager(silent=True, backend=recorder)
+        manager._reload()
+        recorded = katoolin3.RecordedManager(manager, recorder)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            recorded.package_states()
+            recorded.search_hits("sql injection")
+            recorded.info("nmap")
+            recorded.is_installed("nmap")
+
+        recorder.close()
+
+    def test_round_trip_with_state_on_disk(self):
+        # A warm snapshot and search index of an earlier run
+        manager = katoolin3.APTManager(silent=True, backend=self.backend)
+        manager._reload()
+        manager.package_states()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            manager.search_index()
+
+        self.assertTrue(os.path.isfile(katoolin3.PackageSnapshot.path))
+        self.assertTrue(os.path.isfile(katoolin3.SearchIndex.path))
+
+        log = os.path.join(self.tmp, "session.log")
+        self.record(log)
+
+        # replay.py starts with an empty state directory
+        self.new_state_dir()
+        calls = replay.replay(log, 0)
+
+        self.assertEqual([call["name"] for call in calls], ["package_states", "search_hits", "info", "is_installed"])
+        self.assertEqual([call["error"] for call in calls], [None] * 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for a katoolin3 that runs next to katoolin3d and has to
+leave its sources file and Kali lists alone (shares_sources).
+This needs python3-apt but no root.
+
+Invoke with: python3 -m unittest discover tests
+"""
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import apt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "maintenance"))
+
+import katoolin3
+import benchmark
+
+class SharedSourcesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp(prefix="katoolin3-test-")
+        cls.root = benchmark.build_root(cls.tmp, 100, 0)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def setUp(self):
+        self.sources_file = os.path.join(self.tmp, "katoolin3.list")
+
+        with open(self.sources_file, "w") as file:
+            file.write("written by katoolin3d\n")
+
+        self.socket = os.path.join(self.tmp, "katoolin3.sock")
+        self.daemon = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.daemon.bind(self.socket)
+        self.daemon.listen()
+
+        state_dir = tempfile.mkdtemp(dir=self.tmp)
+        patches = [
+            mock.patch.object(katoolin3.APTManager, "sources_file", self.sources_file),
+            mock.patch.object(katoolin3.IndexFreshness, "state_dir", state_dir),
+            mock.patch.object(katoolin3.PackageSnapshot, "path", os.path.join(state_dir, "snapshot.json"))
+        ]
+
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.daemon.close()
+        os.remove(self.socket)
+
+    def args(self, **kwargs):
+        args = {"socket": self.socket, "bundle": None, "mirror": katoolin3.APTManager.mirror}
+        args.update(kwargs)
+        return types.SimpleNamespace(**args)
+
+    def test_daemon_is_detected(self):
+        self.assertTrue(katoolin3.shares_sources(self.args()))
+        self.assertFalse(katoolin3.shares_sources(self.args(socket=self.socket + ".missing")))
+
+    def test_other_sources_are_refused(self):
+        for args in (self.args(bundle=self.tmp), self.args(mirror="http://localhost/kali")):
+            with self.assertRaises(katoolin3.VisibleError):
+                katoolin3.shares_sources(args)
+
+    def test_sources_and_lists_are_left_alone(self):
+        with mock.patch.object(katoolin3.IndexFreshness, "drop") as drop, \
+                mock.patch.object(katoolin3.IndexFreshness, "stash") as stash, \
+                mock.patch.object(katoolin3.APTManager, "_update") as update:
+            with katoolin3.APTManager(silent=True, backend=lambda: apt.Cache(rootdir=self.root), shared=True) as manager:
+                self.assertEqual(len(manager.package_states()), len(katoolin3.REGISTRY.names))
+
+        update.assert_not_called()
+        stash.assert_not_called()
+        drop.assert_not_called()
+
+        with open(self.sources_file) as file:
+            self.assertEqual(file.read(), "written by katoolin3d\n")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,10 +2,21 @@
 
 source "conf.sh";
 
+if [ -f "$UNITDIR/$DAEMON.service" ];
+then
+    systemctl disable --now "$DAEMON" 2>/dev/null;
+    rm -f "$UNITDIR/$DAEMON.service";
+fi
+
 rm -f "$DIR/$PROGRAM" || die "Uninstallation failed.";
+rm -f "$DIR/$DAEMON";
+rm -rf "$DATADIR";
 
 # Make sure the repository gets deleted
 rm -f "/etc/apt/sources.list.d/katoolin3.list";
 
+# Remove cached package lists and other state
+rm -rf "/var/lib/katoolin3" "/var/cache/katoolin3";
+
 echo "Successfully uninstalled.";
 exit 0;
\ No newline at end of file